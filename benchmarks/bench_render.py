@@ -0,0 +1,148 @@
+import argparse
+import sys
+import timeit
+from xml.etree import ElementTree as ET
+
+from bs4 import BeautifulSoup
+
+from src.render import doc_to_fb2, doc_to_xhtml, parse_html, to_fb2, to_xhtml
+
+
+# Прежние EpubHandler._parse_doc и FB2Handler._parse_doc, для сравнения
+def legacy_epub(content: list[dict], images: dict[str, str]) -> str:
+    tags: list[str] = []
+    for item in content:
+        if item.get("type") == "image":
+            img_name = item.get("attrs").get("images")[-1].get("image")
+            tags.append(f"<img src='{images.get(img_name)}'/>")
+
+        elif item.get("type") == "paragraph":
+            text = ""
+            paragraph_content = item.get("content")
+            if paragraph_content and paragraph_content[0].get("type") == "text":
+                text = paragraph_content[0].get("text")
+
+            tags.append(f"<p>{text}</p>")
+
+        elif item.get("type") == "horizontalRule":
+            tags.append("<hr/>")
+
+    return "".join(tags)
+
+
+def legacy_fb2(content: list[dict]) -> list[ET.Element]:
+    tags: list = []
+    for item in content:
+        if item.get("type") == "image":
+            pass
+
+        elif item.get("type") == "paragraph":
+            text = ""
+            paragraph_content = item.get("content")
+            if paragraph_content and paragraph_content[0].get("type") == "text":
+                text = paragraph_content[0].get("text")
+            tag = ET.Element("p")
+            tag.text = text
+            tags.append(tag)
+
+        elif item.get("type") == "horizontalRule":
+            tags.append(ET.Element("hr"))
+
+    return tags
+
+
+# Прежние EpubHandler._parse_html и FB2Handler._parse_html
+def legacy_epub_html(content: str) -> str:
+    soup = BeautifulSoup(content, "html.parser")
+    tags: list = []
+    for tag in soup.find_all(recursive=False):
+        if tag.name == "img":
+            tag["src"] = "static/" + tag["src"].split("/")[-1]
+        tags.append(tag)
+
+    return "".join([tag.__str__() for tag in tags])
+
+
+def legacy_fb2_html(content: str) -> list[ET.Element]:
+    soup = BeautifulSoup(content, "html.parser")
+    tags: list = []
+    for tag in soup.find_all(recursive=False):
+        tags.append(ET.fromstring(tag.__str__()))
+
+    return tags
+
+
+def make_html(paragraphs: int) -> str:
+    parts: list[str] = []
+    for i in range(paragraphs):
+        parts.append(f"<p>Абзац {i}. {'Обычный текст. ' * 8}<em>выделенный</em> и <strong>жирный</strong> текст.</p>\n")
+        if i % 50 == 49:
+            parts.append('<p><img src="/uploads/ranobe/1/illustration.jpg"></p>\n<hr>\n')
+
+    return "".join(parts)
+
+
+def make_doc(paragraphs: int, marks: bool) -> list[dict]:
+    content: list[dict] = []
+    for i in range(paragraphs):
+        text = [{"type": "text", "text": f"Абзац {i}. " + "Обычный текст. " * 8}]
+        if marks:
+            text += [
+                {"type": "text", "text": "выделенный", "marks": [{"type": "italic"}]},
+                {"type": "text", "text": " и ", "marks": []},
+                {"type": "text", "text": "жирный", "marks": [{"type": "bold"}, {"type": "underline"}]},
+                {"type": "text", "text": " текст. " * 4},
+            ]
+        content.append({"type": "paragraph", "content": text})
+        if i % 50 == 49:
+            content.append({"type": "image", "attrs": {"images": [{"image": "illustration"}]}})
+            content.append({"type": "horizontalRule"})
+
+    return content
+
+
+def measure(cases: dict, number: int) -> None:
+    for name, case in cases.items():
+        seconds = min(timeit.repeat(case, number=number, repeat=3)) / number
+        print(f"  {name:<16} {seconds * 1000:8.3f} мс на главу")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Сравнение старого и нового разбора глав форматов doc и html.")
+    parser.add_argument("--paragraphs", type=int, default=400, help="абзацев в главе")
+    parser.add_argument("--number", type=int, default=200, help="повторов замера")
+    args = parser.parse_args()
+
+    images = {"illustration": "static/1_illustration.jpg"}
+
+    for title, marks in (("один текстовый узел на абзац", False), ("абзацы с разметкой", True)):
+        content = make_doc(args.paragraphs, marks)
+        cases = {
+            "epub, прежний": lambda content=content: legacy_epub(content, images),
+            "epub, render": lambda content=content: doc_to_xhtml(content, images.get),
+            "fb2, прежний": lambda content=content: legacy_fb2(content),
+            "fb2, render": lambda content=content: doc_to_fb2(content),
+        }
+
+        print(f"\nГлава на {args.paragraphs} абзацев, {title}:")
+        measure(cases, args.number)
+
+        legacy_size, size = len(legacy_epub(content, images)), len(doc_to_xhtml(content, images.get))
+        print(f"  размер XHTML: прежний {legacy_size}, render {size}")
+
+    content = make_html(args.paragraphs)
+    cases = {
+        "epub, прежний": lambda: legacy_epub_html(content),
+        "epub, render": lambda: to_xhtml(parse_html(content), lambda url: "static/" + url.split("/")[-1]),
+        "fb2, прежний": lambda: legacy_fb2_html(content),
+        "fb2, render": lambda: to_fb2(parse_html(content)),
+    }
+
+    print(f"\nHTML-глава на {args.paragraphs} абзацев:")
+    measure(cases, args.number)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+import hashlib
+import io
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+
+# Синтетические ответы в формате api.lib.social. Число глав задаётся в slug: bench-1000
+SLUG_PATTERN = re.compile(r"^bench-(\d+)$")
+CHAPTERS_PER_VOLUME = 50
+PARAGRAPHS_PER_CHAPTER = 40
+IMAGE_EVERY = 10
+
+
+def _make_image(color: str, size: tuple[int, int], format: str) -> bytes:
+    with io.BytesIO() as buf:
+        Image.new("RGB", size, color).save(buf, format=format)
+        return buf.getvalue()
+
+
+class FakeApi:
+    latency: float
+    error_rate: float
+    rate_limit: float | None
+    url: str
+
+    def __init__(
+        self, latency: float = 0.0, error_rate: float = 0.0, rate_limit: float | None = None, seed: int = 0
+    ) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+        # Сервер с лимитом отвечает 429 с Retry-After, когда за последнюю секунду запросов больше rate_limit
+        self.rate_limit = rate_limit
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.not_modified = 0
+        self.window: deque[float] = deque()
+        self.images = {
+            "cover.jpg": _make_image("navy", (600, 900), "JPEG"),
+            "separator.png": _make_image("gray", (400, 20), "PNG"),
+            "illustration.jpg": _make_image("teal", (800, 1200), "JPEG"),
+        }
+
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                api.handle(self)
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self) -> "FakeApi":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _status(self) -> int:
+        with self.lock:
+            self.requests += 1
+
+            if self.rate_limit:
+                now = time.monotonic()
+                while self.window and now - self.window[0] > 1.0:
+                    self.window.popleft()
+                if len(self.window) >= self.rate_limit:
+                    self.throttled += 1
+                    return 429
+                self.window.append(now)
+
+            return 503 if self.random.random() < self.error_rate else 200
+
+    def handle(self, request: BaseHTTPRequestHandler) -> None:
+        url = urlparse(request.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        parts = url.path.strip("/").split("/")
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        status = self._status()
+        if status == 429:
+            self.send(request, 429, b'{"message": "Too Many Requests"}', "application/json", {"Retry-After": "1"})
+            return
+        if status == 503:
+            self.send(request, 503, b'{"message": "Service Unavailable"}', "application/json")
+            return
+
+        match parts:
+            case ["img", name] if name in self.images:
+                content_type = "image/png" if name.endswith(".png") else "image/jpeg"
+                self.send(request, 200, self.images[name], content_type)
+            case ["api", "branches", _]:
+                self.send_json(request, [{"id": 1, "name": "Основная", "teams": [{"name": "Bench"}]}])
+            case ["api", "manga", slug] if SLUG_PATTERN.match(slug):
+                self.send_json(request, self.ranobe(slug))
+            case ["api", "manga", slug, "chapters"] if SLUG_PATTERN.match(slug):
+                self.send_json(request, self.chapters(int(SLUG_PATTERN.match(slug).group(1))))
+            case ["api", "manga", slug, "chapter"] if SLUG_PATTERN.match(slug):
+                self.send_json(request, self.chapter(query["volume"], query["number"]))
+            case _:
+                self.send(request, 404, b'{"message": "Not Found"}', "application/json")
+
+    def send(
+        self,
+        request: BaseHTTPRequestHandler,
+        status: int,
+        body: bytes,
+        content_type: str,
+        headers: dict[str, str] | None = None,
+    ) -> None:
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(body)
+
+    def send_json(self, request: BaseHTTPRequestHandler, data) -> None:
+        body = json.dumps({"data": data}, ensure_ascii=False).encode()
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if request.headers.get("If-None-Match") == etag:
+            with self.lock:
+                self.not_modified += 1
+            self.send(request, 304, b"", "application/json", {"ETag": etag})
+            return
+
+        self.send(request, 200, body, "application/json", {"ETag": etag})
+
+    def ranobe(self, slug: str) -> dict:
+        return {
+            "id": 1,
+            "slug": slug,
+            "name": slug,
+            "rus_name": f"Бенчмарк {slug}",
+            "authors": [{"name": "Автор"}],
+            "genres": [{"name": "Фэнтези"}],
+            "summary": "Синтетическая книга для замеров.\nВторой абзац.",
+            "franchise": [],
+            "chap_count": int(SLUG_PATTERN.match(slug).group(1)),
+            "cover": {"default": f"{self.url}/img/cover.jpg"},
+        }
+
+    def chapters(self, count: int) -> list[dict]:
+        return [
+            {
+                "id": i,
+                "name": f"Глава номер {i}",
+                "number": str(i),
+                "volume": str((i - 1) // CHAPTERS_PER_VOLUME + 1),
+                "branches": [{"branch_id": 1}],
+            }
+            for i in range(1, count + 1)
+        ]
+
+    def chapter(self, volume: str, number: str) -> dict:
+        content = []
+        attachments = []
+        for i in range(PARAGRAPHS_PER_CHAPTER):
+            content.append(
+                {
+                    "type": "paragraph",
+                    "content": [{"type": "text", "text": f"Глава {number}, абзац {i}. " + "Текст абзаца. " * 20}],
+                }
+            )
+
+        if int(number) % IMAGE_EVERY == 0:
+            for name in ("separator", "illustration"):
+                extension = "png" if name == "separator" else "jpg"
+                attachments.append(
+                    {
+                        "id": name,
+                        "name": name,
+                        "filename": f"{name}.{extension}",
+                        "extension": extension,
+                        "url": f"/img/{name}.{extension}",
+                        "width": 1,
+                        "height": 1,
+                    }
+                )
+                content.append({"type": "image", "attrs": {"images": [{"image": name}]}})
+            content.append({"type": "horizontalRule"})
+
+        return {
+            "id": int(number),
+            "number": number,
+            "volume": volume,
+            "content": {"type": "doc", "content": content},
+            "attachments": attachments,
+        }
@@ -0,0 +1,162 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_api import FakeApi
+
+
+class BenchWorker:
+    is_cancelled: bool = False
+
+
+def peak_rss() -> int | None:
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    # В Linux ru_maxrss в килобайтах, в macOS в байтах
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def run_child(args: argparse.Namespace) -> dict:
+    from main import handlers
+    from src.api import get_chapters_data, get_ranobe_data
+    from src.config import config
+    from src.trace import tracer
+
+    config.api_url = args.url
+    config.site_url = args.url
+    config.workers = args.workers
+    config.pool_size = max(config.pool_size, args.workers)
+    config.rate_limit = args.rate
+    config.rate_max = max(args.max_rate, args.rate)
+    config.cache_enabled = args.cache
+    config.cache_dir = args.cache_dir
+    if args.trace:
+        tracer.enable()
+
+    slug = f"bench-{args.size}"
+    ranobe_data = get_ranobe_data(slug)
+    chapters_data = get_chapters_data(slug, ranobe_data.get("chap_count"))
+
+    done = []
+    ebook = handlers[args.format](log_func=lambda *args: None, progress_bar_step=done.append)
+
+    started = time.perf_counter()
+    ebook.make_book(ranobe_data)
+    ebook.fill_book(slug, "1", chapters_data, BenchWorker())
+    filled = time.perf_counter()
+
+    with tempfile.TemporaryDirectory() as output:
+        ebook.end_book()
+        ebook.save_book(output)
+        saved = time.perf_counter()
+        size = sum(entry.stat().st_size for entry in os.scandir(output))
+
+    if args.trace:
+        tracer.export(os.path.join(args.trace, f"{args.format}-{args.size}.json"))
+        print("\n".join(tracer.summary()))
+
+    return {
+        "format": args.format,
+        "chapters": len(chapters_data),
+        "skipped": len(chapters_data) - len(done),
+        "fill_seconds": filled - started,
+        "chapters_per_second": len(done) / (filled - started),
+        "save_seconds": saved - filled,
+        "peak_rss": peak_rss(),
+        "output_size": size,
+    }
+
+
+def format_size(size: int | None) -> str:
+    return "-" if size is None else f"{size / 1024 / 1024:.1f} MiB"
+
+
+def print_table(results: list[dict]) -> None:
+    header = (
+        f"{'формат':<12} {'глав':>6} {'пропущено':>9} {'гл/с':>8} "
+        f"{'скачивание':>11} {'сохранение':>11} {'пик RSS':>11} {'книга':>11}"
+    )
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        print(
+            f"{result['format']:<12} {result['chapters']:>6} {result['skipped']:>9} "
+            f"{result['chapters_per_second']:>8.1f} {result['fill_seconds']:>10.2f}s {result['save_seconds']:>10.2f}s "
+            f"{format_size(result['peak_rss']):>11} {format_size(result['output_size']):>11}"
+        )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Замеры скачивания и сохранения книг на локальном фейковом API.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000], help="число глав в книге")
+    parser.add_argument("--formats", nargs="+", default=["epub", "epub_stream", "fb2"], help="форматы книг")
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка ответа сервера в секундах")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument("--workers", type=int, default=8, help="число параллельных запросов")
+    parser.add_argument("--rate", type=float, default=1000.0, help="начальная скорость запросов в секунду")
+    parser.add_argument("--max-rate", type=float, default=1000.0, help="предел роста скорости запросов")
+    parser.add_argument("--server-rate", type=float, help="лимит сервера в запросах в секунду, сверх него 429")
+    parser.add_argument("--cache", action="store_true", help="включить кэш глав и картинок")
+    parser.add_argument("--json", help="сохранить результаты в JSON-файл")
+    parser.add_argument("--trace", help="папка для трассировок прогонов (Chrome trace JSON), сводка выводится сразу")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--format", help=argparse.SUPPRESS)
+    parser.add_argument("--cache-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args)))
+        return 0
+
+    if args.trace:
+        os.makedirs(args.trace, exist_ok=True)
+
+    results = []
+    api = FakeApi(latency=args.latency, error_rate=args.error_rate, rate_limit=args.server_rate)
+    with api, tempfile.TemporaryDirectory() as cache_dir:
+        for size in args.sizes:
+            for format in args.formats:
+                # Каждый замер в отдельном процессе, чтобы пик RSS не копился между прогонами
+                command = [
+                    sys.executable, "-m", "benchmarks.run", "--child",
+                    "--url", api.url,
+                    "--size", str(size),
+                    "--format", format,
+                    "--workers", str(args.workers),
+                    "--rate", str(args.rate),
+                    "--max-rate", str(args.max_rate),
+                    "--cache-dir", cache_dir,
+                ]  # fmt: skip
+                if args.cache:
+                    command.append("--cache")
+                if args.trace:
+                    command += ["--trace", os.path.abspath(args.trace)]
+
+                output = subprocess.run(command, capture_output=True, text=True, check=True).stdout.strip().splitlines()
+                results.append(json.loads(output[-1]))
+                if args.trace:
+                    print("\n".join(output[:-1]))
+                print(f"{format} на {size} глав: {results[-1]['fill_seconds'] + results[-1]['save_seconds']:.2f}s")
+
+    print()
+    print_table(results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,25 +1,32 @@
-#  import argparse
+import sys
 import traceback
+import multiprocessing
 import os
 from pathlib import Path
 
-from src.menu import Ranobe2ebook
 from src.fb2 import FB2Handler
 from src.epub import EpubHandler
+from src.epub_stream import EpubStreamHandler
+from src.multi import EpubFB2Handler
+
+handlers = {"epub": EpubHandler, "epub_stream": EpubStreamHandler, "fb2": FB2Handler, "epub_fb2": EpubFB2Handler}
 
 if __name__ == "__main__":
-    # parser = argparse.ArgumentParser()
-    # parser.add_argument("--test", type=str, default=None)
-    # args = parser.parse_args()
+    multiprocessing.freeze_support()
+
+    # С аргументами работаем без интерфейса, textual при этом не импортируется
+    if len(sys.argv) > 1:
+        from src.cli import main
+
+        sys.exit(main(handlers))
 
-    # if args.test:
-    #     print("Запущен скрипт с включенной детализацией")
+    from src.menu import Ranobe2ebook
 
     doc_path = os.path.normpath(os.path.expanduser("~/Documents"))
     logs_dir = f"{doc_path}\\ranobelib-parser-logs"
     Path(f"{logs_dir}").mkdir(parents=True, exist_ok=True)
     try:
-        app = Ranobe2ebook(handlers={"fb2": FB2Handler, "epub": EpubHandler})
+        app = Ranobe2ebook(handlers=handlers)
         app.run()
     except RuntimeError:
         pass
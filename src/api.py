@@ -1,28 +1,88 @@
 import io
+import json
+import time
+from typing import Callable, Iterable, Iterator
 
 from PIL import Image
 import PIL
-import cloudscraper
-import requests
 
+from src.cache import get_chapter_cache, get_response_cache
+from src.chapters import Chapters
 from src.config import config
-from src.model import Attachment, ChapterData, ChapterMeta
-from src.utils import is_html, is_url
+from src.model import Attachment, ChapterData
+from src.ratelimit import RETRY_STATUSES, AdaptiveRateLimiter, retry_after
+from src.session import get_scraper, get_session
+from src.trace import Span, tracer, traced
+from src.utils import is_html
 
 
-def get_branchs(id: str) -> dict:
-    url = f"https://api.lib.social/api/branches/{id}?team_defaults=1"
+CHUNK_SIZE = 64 * 1024
+
+
+def _read_data(chunks: Iterable[bytes]) -> dict | list:
+    return json.loads(b"".join(chunks)).get("data")
+
+
+def _counted(chunks: Iterable[bytes], span: Span) -> Iterator[bytes]:
+    for chunk in chunks:
+        span.bytes += len(chunk)
+        yield chunk
+
 
-    response = requests.get(url)
+def _get_data(
+    url: str, signal: str | None = None, load: Callable[[Iterable[bytes]], dict | list] = _read_data
+) -> dict | list | None:
+    # load разбирает тело ответа по кускам, его результат и кладём в кэш
+    cache = get_response_cache()
+    cached = cache.get(url) if cache else None
 
+    # signal - дешёвый признак изменений (chap_count): пока он прежний, ответ не перезапрашиваем
+    if (
+        cached is not None
+        and signal is not None
+        and cached.signal == signal
+        and time.time() - cached.checked < config.chapters_list_ttl
+    ):
+        return cached.data
+
+    headers = {}
+    if cached is not None:
+        if cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+
+    try:
+        with tracer.span("api.metadata", url=url) as span:
+            with get_session().get(url, headers=headers, timeout=config.timeout, stream=True) as response:
+                span.args["status"] = response.status_code
+                if response.status_code == 200:
+                    data = load(_counted(response.iter_content(CHUNK_SIZE), span))
+    except Exception:
+        if cached is None:
+            raise
+        return cached.data
+
+    if response.status_code == 304 and cached is not None:
+        cache.touch(url, signal)
+        return cached.data
     if response.status_code != 200:
         return None
 
-    return response.json().get("data")
+    if cache:
+        cache.put(url, data, response.headers.get("ETag"), response.headers.get("Last-Modified"), signal)
+
+    return data
+
+
+def get_branchs(id: str) -> dict:
+    url = f"{config.api_url}/api/branches/{id}?team_defaults=1"
+
+    return _get_data(url)
 
 
 def get_ranobe_data(name: str) -> dict:
-    url_base = f"https://api.lib.social/api/manga/{name}?"
+    url_base = f"{config.api_url}/api/manga/{name}?"
     url = url_base + "&".join(
         [
             f"fields[]={item}"
@@ -37,113 +97,155 @@ def get_ranobe_data(name: str) -> dict:
             ]
         ]
     )
-    response = requests.get(
-        url,
-        headers={"Authorization": f"Bearer {config.token}"},
-    )
-    if response.status_code != 200:
-        return None
 
-    return response.json().get("data")
+    return _get_data(url)
 
 
-def get_chapters_data(name: str) -> list[ChapterMeta]:
-    url = f"https://api.lib.social/api/manga/{name}/chapters"
+def get_chapters_data(name: str, chap_count: int | None = None) -> Chapters | None:
+    url = f"{config.api_url}/api/manga/{name}/chapters"
 
-    response = requests.get(
-        url,
-        headers={"Authorization": f"Bearer {config.token}"},
+    # Список глав разбирается по мере скачивания сразу в столбцы, в кэше тоже лежат столбцы
+    data = _get_data(
+        url, None if chap_count is None else str(chap_count), lambda chunks: Chapters.from_stream(chunks).to_columns()
     )
-    if response.status_code != 200:
+    if data is None:
         return None
-    chapters = [
-        ChapterMeta(name=data.get("name"), number=data.get("number"), volume=data.get("volume"))
-        for data in response.json().get("data")
-    ]
 
-    return chapters
+    # В кэше от прошлых версий список глав лежит как в ответе API
+    return Chapters.from_columns(data) if isinstance(data, dict) else Chapters.from_items(data)
 
 
-def get_image_content(url: str, format: str) -> bytes:
+def transcode_image(content: bytes, format: str) -> bytes:
     try:
-        scraper = cloudscraper.create_scraper(
-            delay=15,
-            browser={"browser": "firefox", "platform": "windows", "mobile": False},
-        )
-        if format.upper() == "JPG":
-            format = "JPEG"
-
-        if not is_url(url):
-            return b""
-
-        response = scraper.get(url)
-
-        match response.status_code:
-            case 200:
-                with Image.open(io.BytesIO(response.content)) as img:
-                    with io.BytesIO() as io_buf:
-                        img.save(io_buf, format=format, quality=70)
-                        io_buf.seek(0)
-                        return io_buf.read()
-
-            case 404:
-                raise Exception(
-                    f"Error {response.status_code}: {response.reason}. {url=} \nКартинка не найдена по ссылке в API. Пропускаем картинку."
-                )
-
-            case _:
-                raise Exception(
-                    f"Error {response.status_code}: {response.reason}. {url=} \nНе удалось получить картинку. Пропускаем картинку."
-                )
+        with Image.open(io.BytesIO(content)) as img:
+            with io.BytesIO() as io_buf:
+                img.save(io_buf, format=format, quality=70)
+                return io_buf.getvalue()
 
     except PIL.UnidentifiedImageError:
         raise Exception("Что то не так с картинкой. Пропускаем картинку.")
 
-    except Exception as e:
-        raise Exception(e)
+
+def resize_cover(content: bytes) -> bytes:
+    # Обложка уменьшается до config.cover_size и пересохраняется в JPEG: FB2 помечает её как image/jpeg
+    try:
+        with Image.open(io.BytesIO(content)) as img:
+            width, height = config.cover_size
+            if img.format == "JPEG" and img.width <= width and img.height <= height:
+                return content
+
+            img.thumbnail(config.cover_size)
+            with io.BytesIO() as io_buf:
+                img.convert("RGB").save(io_buf, format="JPEG", quality=config.cover_quality)
+                return io_buf.getvalue()
+
+    except PIL.UnidentifiedImageError:
+        raise Exception("Что то не так с обложкой. Книга будет без обложки.")
+
+
+def download_image(url: str) -> bytes:
+    with tracer.span("api.download_image", url=url) as span:
+        response = get_scraper().get(url, timeout=config.timeout)
+        span.bytes = len(response.content)
+
+    match response.status_code:
+        case 200:
+            return response.content
+
+        case 404:
+            raise Exception(
+                f"Error {response.status_code}: {response.reason}. {url=} \nКартинка не найдена по ссылке в API. Пропускаем картинку."
+            )
+
+        case _:
+            raise Exception(
+                f"Error {response.status_code}: {response.reason}. {url=} \nНе удалось получить картинку. Пропускаем картинку."
+            )
 
 
-def get_chapter(name: str, priority_branch: str, number: int, volume: int) -> ChapterData:
-    url = f"https://api.lib.social/api/manga/{name}/chapter?branch_id={priority_branch}&number={number}&volume={volume}"
-    response = requests.get(
-        url,
-        headers={
-            "Authorization": f"Bearer {config.token}",
-        },
+def image_format(format: str) -> str:
+    return "JPEG" if format.upper() == "JPG" else format
+
+
+def parse_chapter(data: dict) -> ChapterData:
+    if isinstance(data.get("content"), str) and is_html(data.get("content")):
+        type = "html"
+        content = data.get("content")
+    else:
+        type = "doc"
+        content = data.get("content").get("content")
+
+    attachments = []
+    if len(data.get("attachments")):
+        for item in data.get("attachments"):
+            attachments.append(
+                Attachment(
+                    id=item.get("id"),
+                    name=item.get("name"),
+                    url=item.get("url"),
+                    extension=item.get("extension"),
+                    filename=item.get("filename"),
+                    width=item.get("width"),
+                    height=item.get("height"),
+                )
+            )
+
+    return ChapterData(
+        id=data.get("id"),
+        number=data.get("number"),
+        volume=data.get("volume"),
+        type=type,
+        content=content,
+        attachments=attachments,
     )
-    if response.status_code != 200:
-        raise Exception(f"Ошибка при получении главы {volume} - {number}. Пропускаем главу {volume} - {number}")
+
+
+@traced("api.get_chapter")
+def get_chapter(
+    name: str,
+    priority_branch: str,
+    number: int,
+    volume: int,
+    limiter: AdaptiveRateLimiter | None = None,
+    fresh: bool = False,
+) -> ChapterData:
+    # fresh - не брать главу из кэша: обновлению книги нужен текущий текст, чтобы заметить правки
+    cache = get_chapter_cache()
+    data = cache.get(name, priority_branch, volume, number) if cache and not fresh else None
+    if data is not None:
+        return parse_chapter(data)
+
+    url = f"{config.api_url}/api/manga/{name}/chapter?branch_id={priority_branch}&number={number}&volume={volume}"
+    # Без ограничителя запрос один, с ним повторяем, пока сервер перегружен
+    for _ in range(config.retries + 1 if limiter else 1):
+        if limiter is not None:
+            limiter.acquire()
+
+        try:
+            with tracer.span("api.chapter_request", volume=volume, number=number) as span:
+                response = get_session().get(url, timeout=config.timeout)
+                span.bytes = len(response.content)
+                span.args["status"] = response.status_code
+        except Exception:
+            response = None
+
+        if response is not None and response.status_code not in RETRY_STATUSES:
+            break
+        if limiter is not None:
+            limiter.throttle(retry_after(response))
+
+    if response is None or response.status_code != 200:
+        # Устаревшая запись в кэше лучше пропущенной главы
+        data = cache.get(name, priority_branch, volume, number, stale=True) if cache else None
+        if data is None:
+            raise Exception(f"Ошибка при получении главы {volume} - {number}. Пропускаем главу {volume} - {number}")
 
     else:
-        data = response.json().get("data")
+        if limiter is not None:
+            limiter.success()
 
-        if isinstance(data.get("content"), str) and is_html(data.get("content")):
-            type = "html"
-            content = data.get("content")
-        else:
-            type = "doc"
-            content = data.get("content").get("content")
-
-        attachments = []
-        if len(data.get("attachments")):
-            for item in data.get("attachments"):
-                attachments.append(
-                    Attachment(
-                        id=item.get("id"),
-                        name=item.get("name"),
-                        url=item.get("url"),
-                        extension=item.get("extension"),
-                        filename=item.get("filename"),
-                        width=item.get("width"),
-                        height=item.get("height"),
-                    )
-                )
+        data = response.json().get("data")
+        if cache:
+            cache.put(name, priority_branch, volume, number, data)
 
-        return ChapterData(
-            id=data.get("id"),
-            number=data.get("number"),
-            volume=data.get("volume"),
-            type=type,
-            content=content,
-            attachments=attachments,
-        )
+    return parse_chapter(data)
@@ -0,0 +1,30 @@
+from collections import Counter
+
+from src.model import ChapterMeta
+
+
+class BranchIndex:
+    # Какие ветки перевода есть у каждой главы, по списку глав, который уже получен один раз на книгу
+    order: list[str]
+    chapters: dict[str, set[tuple[str, str]]]
+
+    def __init__(self, chapters_data: list[ChapterMeta]) -> None:
+        self.chapters = {}
+        for item in chapters_data:
+            for branch in item.branches:
+                self.chapters.setdefault(branch, set()).add((str(item.volume), str(item.number)))
+
+        # Запасные ветки - по полноте перевода, при равенстве в порядке появления в списке глав
+        coverage = Counter({branch: len(keys) for branch, keys in self.chapters.items()})
+        self.order = [branch for branch, _ in coverage.most_common()]
+
+    def branches(self, item: ChapterMeta, priority_branch: str) -> list[str]:
+        # Без данных о ветках (старый ответ API) просто идём в выбранную
+        if not item.branches:
+            return [str(priority_branch)]
+
+        fallback = [branch for branch in self.order if branch != str(priority_branch) and branch in item.branches]
+        return [str(priority_branch), *fallback] if str(priority_branch) in item.branches else fallback
+
+    def missing(self, chapters_data: list[ChapterMeta], priority_branch: str) -> int:
+        return sum(1 for item in chapters_data if item.branches and str(priority_branch) not in item.branches)
@@ -0,0 +1,297 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+
+from src.config import config
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    return db
+
+
+class ChapterCache:
+    path: str
+    max_size: int
+    ttl: float
+    size: int
+
+    def __init__(self, path: str, max_size: int, ttl: float) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+        self.db = _connect(path)
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chapters (
+                key TEXT PRIMARY KEY,
+                slug TEXT NOT NULL,
+                branch TEXT NOT NULL,
+                volume TEXT NOT NULL,
+                number TEXT NOT NULL,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+            """
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS chapters_accessed ON chapters (accessed)")
+        self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM chapters").fetchone()[0]
+
+    @staticmethod
+    def key(slug: str, branch: str, volume: str, number: str) -> str:
+        return hashlib.sha256(f"{slug}/{branch}/{volume}/{number}".encode()).hexdigest()
+
+    def has(self, slug: str, branch: str, volume: str, number: str) -> bool:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT created FROM chapters WHERE key = ?", (self.key(slug, branch, volume, number),)
+            ).fetchone()
+
+        return row is not None and time.time() - row[0] < self.ttl
+
+    def get(self, slug: str, branch: str, volume: str, number: str, stale: bool = False) -> dict | None:
+        key = self.key(slug, branch, volume, number)
+        with self.lock:
+            row = self.db.execute("SELECT data, created FROM chapters WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+
+            data, created = row
+            if not stale and time.time() - created >= self.ttl:
+                return None
+
+            self.db.execute("UPDATE chapters SET accessed = ? WHERE key = ?", (time.time(), key))
+
+        return json.loads(zlib.decompress(data))
+
+    def put(self, slug: str, branch: str, volume: str, number: str, data: dict) -> None:
+        key = self.key(slug, branch, volume, number)
+        blob = zlib.compress(json.dumps(data, ensure_ascii=False).encode())
+        now = time.time()
+
+        with self.lock:
+            row = self.db.execute("SELECT size FROM chapters WHERE key = ?", (key,)).fetchone()
+            self.db.execute(
+                "INSERT OR REPLACE INTO chapters VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, slug, str(branch), str(volume), str(number), blob, len(blob), now, now),
+            )
+            self.size += len(blob) - (row[0] if row else 0)
+            self._evict()
+
+    def _evict(self) -> None:
+        if self.size <= self.max_size:
+            return
+
+        evicted = []
+        for key, size in self.db.execute("SELECT key, size FROM chapters ORDER BY accessed").fetchall():
+            if self.size <= self.max_size:
+                break
+            evicted.append((key,))
+            self.size -= size
+
+        self.db.executemany("DELETE FROM chapters WHERE key = ?", evicted)
+
+
+class ImageCache:
+    path: str
+    max_size: int
+    size: int
+
+    def __init__(self, path: str, max_size: int) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+        self.db = _connect(path)
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS urls (
+                key TEXT PRIMARY KEY,
+                hash TEXT NOT NULL
+            )
+            """
+        )
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL
+            )
+            """
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS urls_hash ON urls (hash)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS blobs_accessed ON blobs (accessed)")
+        self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    @staticmethod
+    def key(url: str, format: str) -> str:
+        return f"{format.upper()}:{url}"
+
+    def get(self, url: str, format: str) -> bytes | None:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT blobs.hash, blobs.data FROM urls JOIN blobs ON urls.hash = blobs.hash WHERE urls.key = ?",
+                (self.key(url, format),),
+            ).fetchone()
+            if row is None:
+                return None
+
+            self.db.execute("UPDATE blobs SET accessed = ? WHERE hash = ?", (time.time(), row[0]))
+
+        return row[1]
+
+    def put(self, url: str, format: str, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO urls VALUES (?, ?)", (self.key(url, format), digest))
+            row = self.db.execute("SELECT 1 FROM blobs WHERE hash = ?", (digest,)).fetchone()
+            if row is None:
+                self.db.execute("INSERT INTO blobs VALUES (?, ?, ?, ?)", (digest, data, len(data), time.time()))
+                self.size += len(data)
+                self._evict()
+
+        return digest
+
+    def _evict(self) -> None:
+        if self.size <= self.max_size:
+            return
+
+        evicted = []
+        for digest, size in self.db.execute("SELECT hash, size FROM blobs ORDER BY accessed").fetchall():
+            if self.size <= self.max_size:
+                break
+            evicted.append((digest,))
+            self.size -= size
+
+        self.db.executemany("DELETE FROM blobs WHERE hash = ?", evicted)
+        self.db.executemany("DELETE FROM urls WHERE hash = ?", evicted)
+
+
+@dataclass
+class CachedResponse:
+    data: dict | list
+    etag: str | None
+    last_modified: str | None
+    signal: str | None
+    checked: float
+
+
+class ResponseCache:
+    path: str
+    ttl: float
+
+    def __init__(self, path: str, ttl: float) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+        self.db = _connect(path)
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                signal TEXT,
+                checked REAL NOT NULL
+            )
+            """
+        )
+        # Ответы, которые давно не перепроверялись, уже не помогут сэкономить запрос
+        self.db.execute("DELETE FROM responses WHERE checked < ?", (time.time() - ttl,))
+
+    def get(self, url: str) -> CachedResponse | None:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT data, etag, last_modified, signal, checked FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        data, etag, last_modified, signal, checked = row
+        return CachedResponse(json.loads(zlib.decompress(data)), etag, last_modified, signal, checked)
+
+    def put(
+        self, url: str, data: dict | list, etag: str | None, last_modified: str | None, signal: str | None = None
+    ) -> None:
+        blob = zlib.compress(json.dumps(data, ensure_ascii=False).encode())
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (url, blob, etag, last_modified, signal, time.time()),
+            )
+
+    def touch(self, url: str, signal: str | None = None) -> None:
+        with self.lock:
+            self.db.execute(
+                "UPDATE responses SET checked = ?, signal = COALESCE(?, signal) WHERE url = ?",
+                (time.time(), signal, url),
+            )
+
+
+_lock = threading.Lock()
+_chapter_cache: ChapterCache | None = None
+_image_cache: ImageCache | None = None
+_response_cache: ResponseCache | None = None
+
+
+def get_chapter_cache() -> ChapterCache | None:
+    global _chapter_cache
+
+    if not config.cache_enabled:
+        return None
+
+    with _lock:
+        if _chapter_cache is None:
+            _chapter_cache = ChapterCache(
+                os.path.join(config.cache_dir, "chapters.sqlite3"),
+                max_size=config.cache_max_size,
+                ttl=config.cache_ttl,
+            )
+
+        return _chapter_cache
+
+
+def get_image_cache() -> ImageCache | None:
+    global _image_cache
+
+    if not config.cache_enabled:
+        return None
+
+    with _lock:
+        if _image_cache is None:
+            _image_cache = ImageCache(
+                os.path.join(config.cache_dir, "images.sqlite3"),
+                max_size=config.image_cache_max_size,
+            )
+
+        return _image_cache
+
+
+def get_response_cache() -> ResponseCache | None:
+    global _response_cache
+
+    if not config.cache_enabled:
+        return None
+
+    with _lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(os.path.join(config.cache_dir, "responses.sqlite3"), ttl=config.cache_ttl)
+
+        return _response_cache
@@ -0,0 +1,193 @@
+import codecs
+import json
+import sys
+from array import array
+from bisect import bisect_left
+from itertools import pairwise
+from typing import Iterable, Iterator, Sequence, overload
+
+from src.model import ChapterMeta
+
+
+def _key(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("inf")
+
+
+class Chapters(Sequence[ChapterMeta]):
+    # Список глав по столбцам: на 10 тысяч глав это несколько списков строк вместо 10 тысяч объектов.
+    # ChapterMeta создаётся только при обращении к главе
+    names: list[str]
+    numbers: list[str]
+    volumes: list[str]
+    branches: list[tuple[str, ...]]
+
+    def __init__(
+        self,
+        names: list[str],
+        numbers: list[str],
+        volumes: list[str],
+        branches: list[tuple[str, ...]] | None = None,
+    ) -> None:
+        self.names = names
+        self.numbers = numbers
+        self.volumes = volumes
+        self.branches = branches if branches is not None else [()] * len(names)
+
+        # Ключи (том, глава) для поиска делением пополам, если главы идут по порядку, иначе словарь
+        self.volume_keys = array("d", map(_key, volumes))
+        self.number_keys = array("d", map(_key, numbers))
+        self.ordered = all(a <= b for a, b in pairwise(zip(self.volume_keys, self.number_keys)))
+        self.positions = None if self.ordered else {key: i for i, key in enumerate(zip(volumes, numbers))}
+
+    @classmethod
+    def from_items(cls, items: Iterable[dict]) -> "Chapters":
+        names, numbers, volumes, branches = [], [], [], []
+        # Одинаковые тома и наборы веток хранятся одним объектом
+        shared: dict = {}
+        for item in items:
+            names.append(item.get("name") or "")
+            numbers.append(sys.intern(str(item.get("number"))))
+            volumes.append(sys.intern(str(item.get("volume"))))
+            # Основная ветка приходит с branch_id = null, в интерфейсе она "0"
+            ids = tuple(str(branch.get("branch_id") or 0) for branch in item.get("branches") or [])
+            branches.append(shared.setdefault(ids, ids))
+
+        return cls(names, numbers, volumes, branches)
+
+    @classmethod
+    def from_stream(cls, chunks: Iterable[bytes], key: str = "data") -> "Chapters":
+        return cls.from_items(_stream_array(chunks, key))
+
+    @classmethod
+    def from_columns(cls, data: dict) -> "Chapters":
+        return cls(data["names"], data["numbers"], data["volumes"], [tuple(ids) for ids in data["branches"]])
+
+    def to_columns(self) -> dict:
+        return {"names": self.names, "numbers": self.numbers, "volumes": self.volumes, "branches": self.branches}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @overload
+    def __getitem__(self, index: int) -> ChapterMeta: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> "Chapters": ...
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Chapters(self.names[index], self.numbers[index], self.volumes[index], self.branches[index])
+
+        return ChapterMeta(
+            name=self.names[index],
+            number=self.numbers[index],
+            volume=self.volumes[index],
+            branches=list(self.branches[index]),
+        )
+
+    def __iter__(self) -> Iterator[ChapterMeta]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def widths(self) -> tuple[int, int, int]:
+        # Ширина столбцов номера в списке, номера главы и тома для ровного вывода
+        if not self.names:
+            return 0, 0, 0
+        return len(str(len(self))), max(map(len, self.numbers)), len(self.volumes[-1])
+
+    def bisect(self, volume, number) -> int:
+        # Позиция первой главы не раньше "Том volume. Глава number"
+        target = (_key(volume), _key(number))
+        if self.ordered:
+            return bisect_left(range(len(self)), target, key=lambda i: (self.volume_keys[i], self.number_keys[i]))
+
+        return next((i for i in range(len(self)) if (self.volume_keys[i], self.number_keys[i]) >= target), len(self))
+
+    def find(self, volume, number) -> int | None:
+        volume, number = str(volume), str(number)
+        if self.positions is not None:
+            return self.positions.get((volume, number))
+
+        i = self.bisect(volume, number)
+        while i < len(self) and self.volume_keys[i] == _key(volume) and self.number_keys[i] == _key(number):
+            if self.volumes[i] == volume and self.numbers[i] == number:
+                return i
+            i += 1
+        return None
+
+    def between(self, start: tuple | None = None, end: tuple | None = None) -> "Chapters":
+        # Главы с (том, глава) start по end включительно, без границы - с начала или до конца списка
+        first = self.bisect(*start) if start is not None else 0
+        if end is None:
+            return self[first:]
+
+        last = self.find(*end)
+        return self[first : last + 1 if last is not None else self.bisect(*end)]
+
+
+def _stream_array(chunks: Iterable[bytes], key: str) -> Iterator[dict]:
+    # Разбираем ответ {"data": [...], ...} по кускам: элементы массива выдаются по одному,
+    # и весь ответ целиком в памяти не держится
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer = ""
+    pos = 0
+
+    def more() -> bool:
+        nonlocal buffer, pos
+        chunk = next(chunks, None)
+        if chunk is None:
+            return False
+        buffer = buffer[pos:] + utf8.decode(chunk)
+        pos = 0
+        return True
+
+    def skip(chars: str = " \t\r\n") -> str:
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in chars:
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if not more():
+                raise ValueError("Ответ API оборвался")
+
+    def value():
+        nonlocal pos
+        while True:
+            try:
+                result, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if not more():
+                    raise
+                continue
+            # Число в конце куска могло оборваться, дочитываем, пока за ним нет разделителя
+            if end == len(buffer) and more():
+                continue
+            pos = end
+            return result
+
+    if skip() != "{":
+        raise ValueError("Ответ API не объект")
+    pos += 1
+
+    while skip() != "}":
+        name = value()
+        skip()
+        pos += 1  # ":"
+
+        if name == key and skip() == "[":
+            pos += 1
+            while skip(" \t\r\n,") != "]":
+                yield value()
+            pos += 1
+        else:
+            skip()
+            value()
+
+        if skip() == ",":
+            pos += 1
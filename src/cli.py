@@ -0,0 +1,184 @@
+import argparse
+import os
+import signal
+from functools import partial
+from urllib.parse import urlparse
+
+from src.api import get_branchs, get_chapters_data, get_ranobe_data
+from src.config import config
+from src.model import Handler
+from src.multi import MultiHandler
+from src.split import SplitHandler
+from src.trace import tracer
+from src.update import update_book
+from src.utils import parse_chapter_key
+
+
+class CliWorker:
+    is_cancelled: bool = False
+
+    def cancel(self, signum, frame) -> None:
+        # Второй Ctrl+C прерывает программу как обычно
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        print("\nОстанавливаем скачивание и сохраняем уже скачанные главы...")
+        self.is_cancelled = True
+
+
+def get_slug(link: str) -> str:
+    url = urlparse(link)
+    if url.scheme and url.netloc:
+        return url.path.rstrip("/").split("/")[-1]
+    return link
+
+
+def chapter_key(value: str) -> tuple[str, str]:
+    key = parse_chapter_key(value)
+    if key is None:
+        raise argparse.ArgumentTypeError("нужно в виде ТОМ:ГЛАВА, например 2:15")
+    return key
+
+
+def parse_args(formats: list[str], argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="ranobelib-parser",
+        description="Скачивание ранобе с ranobelib.me в EPUB/FB2 без интерфейса.",
+    )
+    parser.add_argument(
+        "links", nargs="+", help="ссылки на ранобе или их slug, с --update пути к книгам; обрабатываются по очереди"
+    )
+    parser.add_argument("-b", "--branch", help="id ветки перевода, по умолчанию первая из списка")
+    parser.add_argument("-s", "--start", type=int, default=1, help="номер первой главы в списке, с 1")
+    parser.add_argument("-n", "--amount", type=int, help="сколько глав скачать, по умолчанию все")
+    parser.add_argument("--from-chapter", type=chapter_key, metavar="ТОМ:ГЛАВА", help="первая глава, например 2:15")
+    parser.add_argument("--to-chapter", type=chapter_key, metavar="ТОМ:ГЛАВА", help="последняя глава включительно")
+    parser.add_argument(
+        "-f",
+        "--format",
+        nargs="+",
+        choices=formats,
+        default=formats[:1],
+        help="форматы книги, при нескольких главы скачиваются один раз",
+    )
+    parser.add_argument("-o", "--output", default=os.getcwd(), help="папка для сохранения книг")
+    parser.add_argument("-t", "--token", default=os.environ.get("RANOBELIB_TOKEN", ""), help="токен авторизации")
+    parser.add_argument("-w", "--workers", type=int, default=config.workers, help="число параллельных запросов")
+    parser.add_argument(
+        "-r", "--rate", type=float, default=config.rate_limit, help="начальное число запросов в секунду"
+    )
+    parser.add_argument(
+        "--max-rate", type=float, default=config.rate_max, help="предел, до которого скорость растёт без ошибок"
+    )
+    parser.add_argument("--no-cache", action="store_true", help="не использовать кэш глав и картинок")
+    parser.add_argument(
+        "--trace", metavar="FILE", help="записать время этапов в FILE (Chrome trace JSON) и вывести сводку"
+    )
+    split = parser.add_mutually_exclusive_group()
+    split.add_argument("--split-volumes", action="store_true", help="отдельная книга на каждый том")
+    split.add_argument("--split-chapters", type=int, metavar="N", help="отдельная книга на каждые N глав")
+    split.add_argument(
+        "--split-size", type=float, metavar="MIB", help="новая книга, когда текст глав превышает размер в МиБ"
+    )
+    parser.add_argument(
+        "-u", "--update", action="store_true", help="дописать новые и изменённые главы в уже скачанные книги"
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="с --update сверить текст прежних глав с сайтом (по запросу на каждую главу книги)",
+    )
+
+    return parser.parse_args(argv)
+
+
+def make_book(slug: str, args: argparse.Namespace, handler: type[Handler], worker: CliWorker) -> bool:
+    print(f"\nПолучаем данные о ранобе {slug}...")
+    ranobe_data = get_ranobe_data(slug)
+    if ranobe_data is None:
+        print("Не удалось получить данные о ранобе.")
+        return False
+
+    branch = args.branch
+    if branch is None:
+        branchs = get_branchs(ranobe_data.get("id"))
+        branch = str(branchs[0].get("id")) if branchs else "0"
+
+    chapters_data = get_chapters_data(slug, ranobe_data.get("chap_count"))
+    if not chapters_data:
+        print("Не удалось получить список глав.")
+        return False
+
+    # -s и -n отсчитываются от --from-chapter, если он задан
+    if args.from_chapter or args.to_chapter:
+        chapters_data = chapters_data.between(args.from_chapter, args.to_chapter)
+
+    start = max(args.start, 1) - 1
+    chapters_data = chapters_data[start : start + args.amount if args.amount else None]
+    if not chapters_data:
+        print("В выбранном диапазоне нет глав.")
+        return False
+
+    ebook = handler(log_func=print, progress_bar_step=lambda step: None)
+    ebook.make_book(ranobe_data)
+    ebook.fill_book(slug, branch, chapters_data, worker)
+    ebook.end_book()
+
+    print("\nСохраняем книгу...")
+    ebook.save_book(args.output)
+    return True
+
+
+def main(handlers: dict[str, type[Handler]], argv: list[str] | None = None) -> int:
+    args = parse_args(list(handlers), argv)
+
+    config.token = args.token
+    config.workers = args.workers
+    config.pool_size = max(config.pool_size, args.workers)
+    config.rate_limit = args.rate
+    config.rate_max = args.max_rate
+    config.cache_enabled = not args.no_cache
+    os.makedirs(args.output, exist_ok=True)
+
+    worker = CliWorker()
+    signal.signal(signal.SIGINT, worker.cancel)
+
+    if args.trace:
+        tracer.enable()
+
+    # Несколько форматов собираются из одного скачивания
+    if len(args.format) > 1:
+        handler = partial(MultiHandler, handler_types=tuple(handlers[format] for format in args.format))
+    else:
+        handler = handlers[args.format[0]]
+
+    # Части сохраняются сразу, как только скачаны их главы
+    if args.split_volumes:
+        handler = partial(SplitHandler, handler_type=handler, dir=args.output, by="volume")
+    elif args.split_chapters:
+        handler = partial(SplitHandler, handler_type=handler, dir=args.output, by="chapters", limit=args.split_chapters)
+    elif args.split_size:
+        limit = int(args.split_size * 1024 * 1024)
+        handler = partial(SplitHandler, handler_type=handler, dir=args.output, by="size", limit=limit)
+
+    failed = 0
+    try:
+        for link in args.links:
+            if worker.is_cancelled:
+                break
+
+            try:
+                if args.update:
+                    done = update_book(link, worker, print, lambda step: None, verify=args.verify)
+                else:
+                    done = make_book(get_slug(link), args, handler, worker)
+                if not done:
+                    failed += 1
+            except Exception as e:
+                print(str(e))
+                failed += 1
+    finally:
+        if args.trace:
+            tracer.export(args.trace)
+            print("\n" + "\n".join(tracer.summary()))
+            print(f"Трассировка сохранена в {args.trace}")
+
+    return 1 if failed else 0
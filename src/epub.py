@@ -1,13 +1,68 @@
-import time
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import replace
 from typing import Callable
 
 
-from bs4 import BeautifulSoup
 from ebooklib import epub
-import requests
 
+from src.config import config
 from src.model import ChapterData, ChapterMeta, Handler, Image
-from src.api import get_chapter, get_image_content
+from src.images import ImagePipeline, ImageStore, fetch_cover, wait_cover
+from src.fetcher import fill_book
+from src.render import doc_to_xhtml, parse_html, to_xhtml
+from src.reproducible import (
+    StableZipFile,
+    book_id,
+    book_metadata,
+    build_time,
+    is_unchanged,
+    manifest_hash,
+    replace_if_changed,
+)
+from src.utils import chapter_hash, chapter_title
+
+
+# Служебные данные для обновления книги: slug, ветка и список глав
+BOOK_META = "META-INF/ranobelib.json"
+# Обложка всегда пересохраняется в JPEG (src.api.resize_cover)
+COVER_NAME = "cover.jpg"
+
+
+def chapter_file_name(item: ChapterMeta) -> str:
+    return item.number + "_" + item.volume + ".xhtml"
+
+
+class StoredImage(epub.EpubImage):
+    # Картинка, которая до записи книги лежит в ImageStore, а не в памяти
+    def __init__(self, uid: str, file_name: str, media_type: str, store: ImageStore, content: bytes) -> None:
+        super().__init__(uid=uid, file_name=file_name, media_type=media_type)
+        self.store = store
+        self.offset, self.length = store.put(content)
+
+    def get_content(self, default: bytes = b"") -> bytes:
+        return self.store.read(self.offset, self.length) or default
+
+
+class StableEpubWriter(epub.EpubWriter):
+    # Одинаковая книга даёт одинаковый файл: дата в метаданных и у файлов архива постоянная
+    def __init__(self, name: str, book: epub.EpubBook, options: dict | None = None) -> None:
+        super().__init__(name, book, {"mtime": build_time(), **(options or {})})
+
+    def write(self) -> None:
+        self.out = StableZipFile(self.file_name, "w", zipfile.ZIP_DEFLATED)
+        self.out.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+
+        self._write_container()
+        self._write_opf()
+        self._write_items()
+
+        self.out.close()
 
 
 class EpubHandler(Handler):
@@ -16,109 +71,192 @@ class EpubHandler(Handler):
     progress_bar_step: Callable
     min_volume: str
     max_volume: str
-
-    def _parse_html(self, chapter: ChapterData) -> tuple[list[str], dict[str, Image]]:
-        try:
-            soup = BeautifulSoup(chapter.content, "html.parser")
-            tags: list = []
-            images: dict[str, Image] = {}
-            for tag in soup.find_all(recursive=False):
-                if tag.name == "img":
-                    url = tag["src"]
-                    img_filename = url.split("/")[-1]
-                    img_uid = f"{chapter.id}_{img_filename}"
-                    image = Image(
-                        uid=img_uid,
-                        name=img_filename.split(".")[0],
-                        url=url,
-                        extension=img_filename.split(".")[-1],
-                    )
-                    images[image.name] = image
-                    tag["src"] = image.static_url
-
-                tags.append(tag)
-        except Exception as e:
-            self.log_func(e)
-
-        return tags, images
-
-    def _parse_doc(self, chapter: ChapterData) -> tuple[list[str], dict[str, Image]]:
-        attachments = chapter.attachments
-        img_base_url = "https://ranobelib.me"
+    image_files: dict[str, str]
+    image_names: set[str]
+    image_pipeline: ImagePipeline | None = None
+    own_pipeline: bool
+    pending_images: deque[tuple[epub.EpubHtml, Image, Future]]
+    waiting_images: dict[epub.EpubHtml, int]
+    slug: str
+    branch: str
+    chapters: list[ChapterMeta]
+    metadata: dict
+    failed_assets: int
+    cover: Future | None
+    image_store: ImageStore | None
+
+    def _parse_html(self, chapter: ChapterData) -> tuple[str, dict[str, Image]]:
+        images: dict[str, Image] = {}
+        sources: dict[str, str] = {}
+
+        def image_src(url: str) -> str:
+            if url not in sources:
+                img_filename = url.split("/")[-1]
+                image = Image(
+                    uid=f"{chapter.id}_{img_filename}",
+                    name=img_filename.split(".")[0],
+                    url=url,
+                    extension=img_filename.split(".")[-1],
+                )
+                images[image.name] = image
+                sources[url] = image.static_url
+            return sources[url]
+
+        return to_xhtml(parse_html(chapter.content), image_src), images
+
+    def _parse_doc(self, chapter: ChapterData) -> tuple[str, dict[str, Image]]:
         images: dict[str, Image] = {}
-        tags: list[str] = []
 
-        for attachment in attachments:
+        for attachment in chapter.attachments:
             img_uid = f"{chapter.id}_{attachment.filename}"
             images[attachment.name] = Image(
                 uid=img_uid,
                 name=attachment.name,
-                url=img_base_url + attachment.url,
+                url=config.site_url + attachment.url,
                 extension=attachment.extension,
             )
 
-        for item in chapter.content:
-            if item.get("type") == "image":
-                img_name = item.get("attrs").get("images")[-1].get("image")
-                tags.append(f"<img src='static/{images.get(img_name).uid}'/>")
+        def image_src(name: str) -> str | None:
+            image = images.get(name)
+            return image.static_url if image else None
 
-            elif item.get("type") == "paragraph":
-                text = ""
-                paragraph_content = item.get("content")
-                if paragraph_content and paragraph_content[0].get("type") == "text":
-                    text = paragraph_content[0].get("text")
+        return doc_to_xhtml(chapter.content, image_src), images
 
-                tags.append(f"<p>{text}</p>")
-
-            elif item.get("type") == "horizontalRule":
-                tags.append("<hr/>")
-
-        return tags, images
-
-    def _make_chapter(
-        self, slug: str, priority_branch: str, item: ChapterMeta
-    ) -> tuple[epub.EpubHtml, dict[str, Image]]:
-        try:
-            chapter: ChapterData = get_chapter(
-                slug,
-                priority_branch,
-                item.number,
-                item.volume,
-            )
-        except Exception as e:
-            self.log_func(str(e))
-            return None, None
-
-        chapter_title = f"Том {item.volume}. Глава {item.number}. {item.name}"
+    def _make_chapter(self, chapter: ChapterData, item: ChapterMeta) -> tuple[epub.EpubHtml, dict[str, Image]]:
+        title = chapter_title(item)
 
         epub_chapter = epub.EpubHtml(
-            title=chapter_title,
-            file_name=item.number + "_" + item.volume + ".xhtml",
+            title=title,
+            file_name=chapter_file_name(item),
         )
-        tags, images = [], {}
 
         if chapter.type == "html":
-            tags, images = self._parse_html(chapter)
-            epub_chapter.set_content(f"<h1>{chapter_title}</h1>" + "".join([tag.__str__() for tag in tags]))
+            content, images = self._parse_html(chapter)
+            epub_chapter.set_content(f"<h1>{title}</h1>" + content)
 
         elif chapter.type == "doc":
-            tags, images = self._parse_doc(chapter)
-            epub_chapter.set_content(
-                f"<h1>{chapter_title}</h1>" + "".join([tag for tag in tags]),
-            )
+            content, images = self._parse_doc(chapter)
+            epub_chapter.set_content(f"<h1>{title}</h1>" + content)
         else:
             self.log_func("Неизвестный тип главы! Невозможно преобразовать в EPUB!")
             return None, None
 
         return epub_chapter, images
 
+    def _add_item(self, item: epub.EpubItem) -> None:
+        self.book.add_item(item)
+
+    def _chapter_ready(self, epub_chapter: epub.EpubHtml) -> None:
+        pass
+
+    def _add_images(self, epub_chapter: epub.EpubHtml, images: dict[str, Image]) -> None:
+        if not images:
+            self._chapter_ready(epub_chapter)
+            return
+
+        self.waiting_images[epub_chapter] = len(images)
+        for img in images.values():
+            self.pending_images.append((epub_chapter, img, self.image_pipeline.submit(img.url, img.extension)))
+
+    def _add_image(self, epub_chapter: epub.EpubHtml, img: Image, content: bytes) -> None:
+        # Одинаковые картинки (разделители, повторные иллюстрации) кладём в книгу один раз
+        digest = hashlib.sha256(content).hexdigest()
+        static_url = self.image_files.get(digest)
+        if static_url is None:
+            # При обновлении книги имя может быть занято другой картинкой из прежней версии
+            if img.static_url in self.image_names:
+                static_url = f"static/{digest[:16]}_{img.uid}"
+                epub_chapter.content = epub_chapter.content.replace(img.static_url, static_url)
+                img.static_url = static_url
+
+            self.image_files[digest] = img.static_url
+            self.image_names.add(img.static_url)
+            self._add_item(self._image_item(f"img_{digest[:16]}", img, content))
+        else:
+            epub_chapter.content = epub_chapter.content.replace(img.static_url, static_url)
+            img.static_url = static_url
+
+    def _image_item(self, uid: str, img: Image, content: bytes) -> epub.EpubImage:
+        if self.image_store is None:
+            self.image_store = ImageStore()
+        return StoredImage(uid, img.static_url, img.media_type, self.image_store, content)
+
+    def _collect_images(self, wait: bool = False) -> None:
+        while self.pending_images and (wait or self.pending_images[0][2].done()):
+            epub_chapter, img, future = self.pending_images.popleft()
+            try:
+                self._add_image(epub_chapter, img, future.result())
+            except Exception as e:
+                self.log_func(str(e))
+                self.failed_assets += 1
+
+            self.waiting_images[epub_chapter] -= 1
+            if self.waiting_images[epub_chapter] == 0:
+                del self.waiting_images[epub_chapter]
+                self._chapter_ready(epub_chapter)
+
+    def copy_chapter(self, item: ChapterMeta, source) -> None:
+        self._collect_images()
+
+        epub_chapter = epub.EpubHtml(title=chapter_title(item), file_name=chapter_file_name(item))
+        epub_chapter.set_content(source.chapter(item))
+        self._add_item(epub_chapter)
+
+        # Картинки переносим как есть, без повторного скачивания и перекодирования
+        for file_name, content in source.images(epub_chapter.content):
+            uid = file_name.removeprefix("static/")
+            img = Image(uid=uid, name=uid, url="", extension=uid.split(".")[-1])
+            self._add_image(epub_chapter, img, content)
+
+        self._chapter_ready(epub_chapter)
+        self.chapters.append(replace(item, hash=source.hash(item)))
+
+    def _manifest(self) -> str:
+        return manifest_hash({**self.metadata, "slug": self.slug, "branch": self.branch}, self.chapters)
+
+    def save_book_as(self, path: str) -> bool:
+        # Книга пишется во временный файл рядом с прежней и заменяет её, только если изменились главы
+        # или данные о ранобе. Картинки читаются из ImageStore по одной, когда их очередь писаться в архив
+        manifest = self._manifest()
+        temp_path = None
+        try:
+            if is_unchanged(path, manifest):
+                return False
+
+            fd, temp_path = tempfile.mkstemp(suffix=".epub", dir=os.path.dirname(path) or None)
+            os.close(fd)
+            writer = StableEpubWriter(temp_path, self.book)
+            writer.process()
+            writer.write()
+            return replace_if_changed(temp_path, path, manifest, not self.failed_assets)
+        finally:
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+            if self.image_store is not None:
+                self.image_store.close()
+                self.image_store = None
+
     def save_book(self, dir: str) -> None:
         safe_title = self.book.title.replace(":", "")
-        epub.write_epub(f"{dir}\\{safe_title}.epub", self.book)
+        if not self.save_book_as(os.path.join(dir, f"{safe_title}.epub")):
+            self.log_func(f"Книга {self.book.title} в формате Epub без изменений.")
+            self.log_func(f"Файл {safe_title}.epub в каталоге {dir} не перезаписан.")
+            return
+
         self.log_func(f"Книга {self.book.title} сохранена в формате Epub.")
         self.log_func(f"В каталоге {dir} создана книга {safe_title}.epub.")
 
     def end_book(self) -> None:
+        self.book.set_identifier(book_id(self.slug, self.branch, self.book.title))
+
+        cover = wait_cover(self.cover, self.log_func)
+        if cover:
+            self.book.set_cover(COVER_NAME, cover, False)
+        elif self.cover is not None:
+            self.failed_assets += 1
+        if self.failed_assets:
+            self.log_func(f"Не скачано картинок: {self.failed_assets}, при следующем запуске книга соберётся заново.")
+
         self.book.toc = (epub.Section("1"),) + tuple(
             chap for chap in self.book.items if isinstance(chap, epub.EpubHtml)
         )
@@ -134,53 +272,68 @@ class EpubHandler(Handler):
             {"name": "series_index", "content": f"Тома c {self.min_volume} по {self.max_volume}"},
         )
 
+        meta = {
+            "slug": self.slug,
+            "branch": self.branch,
+            "chapters": [
+                {"volume": item.volume, "number": item.number, "name": item.name, "hash": item.hash}
+                for item in self.chapters
+            ],
+        }
+        self.book.add_item(
+            epub.EpubItem(
+                uid="ranobelib",
+                file_name=BOOK_META,
+                media_type="application/json",
+                content=json.dumps(meta, ensure_ascii=False).encode(),
+                manifest=False,
+            )
+        )
+
     def fill_book(
         self,
         name: str,
         priority_branch: str,
         chapters_data: list[ChapterMeta],
         worker,
-        delay: float = 0.5,
+        delay: float | None = None,
+        source=None,
     ) -> None:
+        fill_book(self, name, priority_branch, chapters_data, worker, delay, source)
+
+    def begin_chapters(self, slug: str, priority_branch: str, chapters_data: list[ChapterMeta]) -> None:
+        self.slug = slug
+        self.branch = priority_branch
         self.min_volume = str(chapters_data[0].volume)
         self.max_volume = str(chapters_data[-1].volume)
 
-        total_len = len(str(len(chapters_data)))
-        chap_len = len(str(max(chapters_data, key=lambda x: len(str(x.number))).number))
-        volume_len = len(self.max_volume)
-
-        self.log_func(f"\nНачинаем скачивать главы: {len(chapters_data)}")
-
-        for i, item in enumerate(chapters_data, 1):
-            time.sleep(delay)
-            if worker.is_cancelled:
-                break
-
-            epub_chapter, images = self._make_chapter(name, priority_branch, item)
-            if epub_chapter is None:
-                self.log_func("Пропускаем главу.")
-                continue
-
-            self.book.add_item(epub_chapter)
-            for img in images.values():
-                try:
-                    self.book.add_item(
-                        epub.EpubImage(
-                            uid=img.name,
-                            file_name=img.static_url,
-                            media_type=img.media_type,
-                            content=get_image_content(img.url, img.extension),
-                        )
-                    )
-                except Exception as e:
-                    self.log_func(str(e))
-                    continue
-
-            self.log_func(
-                f"Скачали {i:>{total_len}}: Том {item.volume:>{volume_len}}. Глава {item.number:>{chap_len}}. {item.name}"
-            )
+        self.own_pipeline = self.image_pipeline is None
+        if self.own_pipeline:
+            self.image_pipeline = ImagePipeline()
+        self.pending_images = deque()
+        self.waiting_images = {}
+
+    def add_chapter(self, chapter: ChapterData, item: ChapterMeta) -> bool:
+        self._collect_images()
+
+        epub_chapter, images = self._make_chapter(chapter, item)
+        if epub_chapter is None:
+            return False
+
+        self._add_item(epub_chapter)
+        self._add_images(epub_chapter, images)
+        self.chapters.append(replace(item, hash=chapter_hash(chapter)))
+        return True
+
+    def end_chapters(self) -> None:
+        try:
+            self._collect_images(wait=True)
+        finally:
+            if self.own_pipeline:
+                self.image_pipeline.close()
 
-            self.progress_bar_step(1)
+    def share_images(self, pipeline: ImagePipeline) -> None:
+        self.image_pipeline = pipeline
 
     def make_book(self, ranobe_data: dict) -> None:
         self.log_func("\nПодготавливаем книгу...")
@@ -194,8 +347,8 @@ class EpubHandler(Handler):
         for author in ranobe_data.get("authors"):
             book.add_author(author.get("name"))
 
-        cover_url = ranobe_data.get("cover").get("default")
-        book.set_cover(cover_url.split("/")[-1], requests.get(cover_url).content, False)
+        # Обложка качается параллельно с главами и попадает в книгу в end_book
+        self.cover = fetch_cover((ranobe_data.get("cover") or {}).get("default"))
 
         book.add_metadata(
             "DC",
@@ -220,3 +373,10 @@ class EpubHandler(Handler):
         self.log_func("Подготовили книгу.")
 
         self.book = book
+        self.image_files = {}
+        self.image_names = set()
+        self.image_store = None
+        self.slug = self.branch = ""
+        self.chapters = []
+        self.metadata = book_metadata(ranobe_data)
+        self.failed_assets = 0
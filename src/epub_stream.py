@@ -0,0 +1,85 @@
+import os
+import tempfile
+import zipfile
+
+from ebooklib import epub
+
+from src.epub import EpubHandler, StableEpubWriter
+from src.model import Image
+from src.reproducible import StableZipFile, is_unchanged, replace_if_changed
+
+
+class StreamingEpubWriter(StableEpubWriter):
+    written: set[str]
+
+    def __init__(self, name: str, book: epub.EpubBook, options: dict | None = None) -> None:
+        # Список страниц собирается разбором всех глав, а их текста к концу уже нет в памяти
+        super().__init__(name, book, {"epub3_pages": False, **(options or {})})
+        self.written = set()
+
+        self.out = StableZipFile(self.file_name, "w", zipfile.ZIP_DEFLATED)
+        self.out.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        self._write_container()
+
+    def write_item(self, item: epub.EpubItem) -> None:
+        self.out.writestr(f"{self.book.FOLDER_NAME}/{item.file_name}", item.get_content())
+        self.written.add(item.file_name)
+
+        # В книге остаётся только запись для манифеста, содержимое уже в архиве
+        item.content = b""
+
+    def _write_items(self) -> None:
+        for item in self.book.get_items():
+            if item.file_name in self.written:
+                continue
+
+            if isinstance(item, epub.EpubNcx):
+                self.out.writestr(f"{self.book.FOLDER_NAME}/{item.file_name}", self._get_ncx())
+            elif isinstance(item, epub.EpubNav):
+                self.out.writestr(f"{self.book.FOLDER_NAME}/{item.file_name}", self._get_nav(item))
+            elif item.manifest:
+                self.out.writestr(f"{self.book.FOLDER_NAME}/{item.file_name}", item.get_content())
+            else:
+                self.out.writestr(item.file_name, item.get_content())
+
+    def write(self) -> None:
+        self.process()
+        self._write_opf()
+        self._write_items()
+        self.out.close()
+
+
+class EpubStreamHandler(EpubHandler):
+    writer: StreamingEpubWriter
+
+    def make_book(self, ranobe_data: dict) -> None:
+        super().make_book(ranobe_data)
+
+        fd, path = tempfile.mkstemp(suffix=".epub")
+        os.close(fd)
+        self.writer = StreamingEpubWriter(path, self.book)
+
+    def _add_item(self, item: epub.EpubItem) -> None:
+        super()._add_item(item)
+
+        # Главу пишем только после её картинок: дубликаты подменяют ссылки в тексте
+        if not isinstance(item, epub.EpubHtml):
+            self.writer.write_item(item)
+
+    def _chapter_ready(self, epub_chapter: epub.EpubHtml) -> None:
+        self.writer.write_item(epub_chapter)
+
+    def _image_item(self, uid: str, img: Image, content: bytes) -> epub.EpubImage:
+        # Картинка сразу уходит в архив, промежуточный ImageStore не нужен
+        return epub.EpubImage(uid=uid, file_name=img.static_url, media_type=img.media_type, content=content)
+
+    def save_book_as(self, path: str) -> bool:
+        # Главы и картинки уже в архиве, но если книга не изменилась, оглавление не дописываем
+        manifest = self._manifest()
+        if is_unchanged(path, manifest):
+            self.writer.out.close()
+            os.remove(self.writer.file_name)
+            return False
+
+        self.writer.write()
+        return replace_if_changed(self.writer.file_name, path, manifest, not self.failed_assets)
@@ -1,14 +1,33 @@
-import time
-from typing import Callable
+import json
+import os
+import tempfile
+from base64 import b64encode
+from concurrent.futures import Future
+from dataclasses import replace
+from typing import Callable, TextIO
 from xml.etree import ElementTree as ET
 
-import requests
 from FB2 import FictionBook2
-from bs4 import BeautifulSoup
+from FB2.FB2Builder import FB2Builder
 
 from src.model import ChapterData, ChapterMeta, Handler
-from src.api import get_chapter
-from src.utils import set_authors
+from src.fetcher import fill_book
+from src.images import fetch_cover, wait_cover
+from src.render import doc_to_fb2, parse_html, to_fb2
+from src.reproducible import book_id, book_metadata, build_time, manifest_hash, replace_if_changed
+from src.utils import chapter_hash, chapter_title, set_authors
+
+
+# Служебные данные для обновления книги пишем в description, главы узнаём по id секций
+BOOK_META = "ranobelib"
+# Под этим id библиотека FB2 пишет обложку из titleInfo.coverPageImages
+COVER_ID = "title-info-cover_0"
+# Хэши глав известны только к концу книги, поэтому они лежат не в description, а в binary после текста
+HASHES_ID = "ranobelib-hashes"
+
+
+def section_id(item: ChapterMeta) -> str:
+    return f"chapter_{item.volume}_{item.number}"
 
 
 class FB2Handler(Handler):
@@ -17,57 +36,40 @@ class FB2Handler(Handler):
     progress_bar_step: Callable
     min_volume: str
     max_volume: str
+    path: str
+    file: TextIO
+    binaries: list[ET.Element] | None
+    slug: str
+    branch: str
+    cover: Future | None
+    cover_content: bytes | None
+    chapters: list[ChapterMeta]
+    metadata: dict
+    failed_assets: int
 
     def _parse_html(self, chapter: ChapterData) -> list[ET.Element]:
-        try:
-            soup = BeautifulSoup(chapter.content, "html.parser")
-            tags: list = []
-            for tag in soup.find_all(recursive=False):
-                tags.append(ET.fromstring(tag.__str__()))
-        except Exception as e:
-            self.log_func(e)
-
-        return tags
+        return to_fb2(parse_html(chapter.content))
 
     def _parse_doc(self, chapter: ChapterData) -> list[ET.Element]:
-        tags: list = []
+        return doc_to_fb2(chapter.content)
 
-        for item in chapter.content:
-            if item.get("type") == "image":
-                pass
+    def save_book_as(self, path: str) -> bool:
+        return replace_if_changed(self.path, path, self._manifest(), not self.failed_assets)
 
-            elif item.get("type") == "paragraph":
-                text = ""
-                paragraph_content = item.get("content")
-                if paragraph_content and paragraph_content[0].get("type") == "text":
-                    text = paragraph_content[0].get("text")
-                tag = ET.Element("p")
-                tag.text = text
-                tags.append(tag)
-
-            elif item.get("type") == "horizontalRule":
-                tags.append(ET.Element("hr"))
-
-        return tags
+    def _manifest(self) -> str:
+        return manifest_hash({**self.metadata, "slug": self.slug, "branch": self.branch}, self.chapters)
 
     def save_book(self, dir: str) -> None:
         save_title = self.book.titleInfo.title.replace(":", "")
-        self.book.write(dir + f"\\{save_title}.fb2")
+        if not self.save_book_as(os.path.join(dir, f"{save_title}.fb2")):
+            self.log_func(f"Книга {self.book.titleInfo.title} в формате FB2 без изменений.")
+            self.log_func(f"Файл {save_title}.fb2 в каталоге {dir} не перезаписан.")
+            return
+
         self.log_func(f"Книга {self.book.titleInfo.title} сохранена в формате FB2!")
         self.log_func(f"В каталоге {dir} создана книга {save_title}.fb2")
 
-    def _make_chapter(self, slug: str, priority_branch: str, item: ChapterMeta) -> list[ET.Element] | None:
-        try:
-            chapter: ChapterData = get_chapter(
-                slug,
-                priority_branch,
-                item.number,
-                item.volume,
-            )
-        except Exception as e:
-            self.log_func(str(e))
-            return None
-
+    def _make_chapter(self, chapter: ChapterData, item: ChapterMeta) -> list[ET.Element] | None:
         if chapter.type == "html":
             tags = self._parse_html(chapter)
         elif chapter.type == "doc":
@@ -75,16 +77,73 @@ class FB2Handler(Handler):
 
         else:
             self.log_func("Неизвестный тип главы! Невозможно преобразовать в FB2!")
+            return None
 
         return tags
 
+    def _write_header(self) -> None:
+        if self.min_volume:
+            self.book.titleInfo.sequences = [
+                (
+                    self.book.titleInfo.title,
+                    f"Тома c {self.min_volume} по {self.max_volume}",
+                )
+            ]
+
+        # Постоянные id и дата документа, чтобы одинаковая книга давала одинаковый файл
+        self.book.documentInfo.id = book_id(self.slug, self.branch, self.book.titleInfo.title)
+        self.book.documentInfo.date = (build_time(), None)
+
+        # Ссылка на обложку пишется в заголовок, поэтому обложку ждём здесь: если она не скачалась,
+        # ссылки не будет. Обычно она уже готова - скачивание начато ещё при проверке ссылки
+        self.cover_content = wait_cover(self.cover, self.log_func)
+        if self.cover_content:
+            self.book.titleInfo.coverPageImages = [b""]
+        elif self.cover is not None:
+            self.failed_assets += 1
+            self.log_func("Книга соберётся заново при следующем запуске, чтобы добавить обложку.")
+
+        # Описание и обложку собирает сама библиотека FB2, главы в дереве не держим
+        root = FB2Builder(self.book).GetFB2()
+        self.binaries = root.findall("binary")
+
+        if self.slug:
+            custom_info = ET.SubElement(root.find("description"), "custom-info", {"info-type": BOOK_META})
+            custom_info.text = json.dumps({"slug": self.slug, "branch": self.branch}, ensure_ascii=False)
+
+        self.file.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        self.file.write(
+            '<FictionBook xmlns="http://www.gribuser.ru/xml/fictionbook/2.0" xmlns:xlink="http://www.w3.org/1999/xlink">\n'
+        )
+        for element in root:
+            if element.tag != "binary":
+                self.file.write(ET.tostring(element, encoding="unicode"))
+
+        body = ET.Element("body")
+        ET.SubElement(ET.SubElement(body, "title"), "p").text = self.book.titleInfo.title
+        self.file.write(ET.tostring(body, encoding="unicode").removesuffix("</body>"))
+
+    def _write_section(self, item: ChapterMeta, tags: list[ET.Element]) -> None:
+        section = FB2Builder.BuildSectionFromChapter((chapter_title(item), tags))
+        section.set("id", section_id(item))
+        self.file.write(ET.tostring(section, encoding="unicode"))
+
     def end_book(self) -> None:
-        self.book.titleInfo.sequences = [
-            (
-                self.book.titleInfo.title,
-                f"Тома c {self.min_volume} по {self.max_volume}",
-            )
-        ]
+        if self.binaries is None:
+            self._write_header()
+
+        self.file.write("</body>")
+        for binary in self.binaries:
+            if binary.get("id") == COVER_ID:
+                binary.text = b64encode(self.cover_content).decode()
+            self.file.write(ET.tostring(binary, encoding="unicode"))
+        if self.slug:
+            binary = ET.Element("binary", {"id": HASHES_ID, "content-type": "application/json"})
+            hashes = [[str(item.volume), str(item.number), item.hash] for item in self.chapters]
+            binary.text = b64encode(json.dumps(hashes).encode()).decode()
+            self.file.write(ET.tostring(binary, encoding="unicode"))
+        self.file.write("</FictionBook>\n")
+        self.file.close()
 
     def fill_book(
         self,
@@ -92,42 +151,36 @@ class FB2Handler(Handler):
         priority_branch: str,
         chapters_data: list[ChapterMeta],
         worker,
-        delay: float = 0.5,
+        delay: float | None = None,
+        source=None,
     ) -> None:
+        fill_book(self, slug, priority_branch, chapters_data, worker, delay, source)
+
+    def begin_chapters(self, slug: str, priority_branch: str, chapters_data: list[ChapterMeta]) -> None:
+        self.slug = slug
+        self.branch = priority_branch
         self.min_volume = str(chapters_data[0].volume)
         self.max_volume = str(chapters_data[-1].volume)
 
-        len_total = len(str(len(chapters_data)))
-        chap_len = len(str(max(chapters_data, key=lambda x: len(str(x.number))).number))
-        volume_len = len(self.max_volume)
-
-        self.log_func(f"Начинаем скачивать главы: {len(chapters_data)}")
+        self._write_header()
 
-        for i, item in enumerate(chapters_data, 1):
-            time.sleep(delay)
-            if worker.is_cancelled:
-                break
+    def add_chapter(self, chapter: ChapterData, item: ChapterMeta) -> bool:
+        tags: list[ET.Element] | None = self._make_chapter(chapter, item)
+        if tags is None:
+            return False
 
-            tags: list[ET.Element] | None = self._make_chapter(slug, priority_branch, item)
-
-            if tags is None:
-                self.log_func("Пропускаем главу.")
-                continue
-
-            chap_title = f"Том {item.volume}. Глава {item.number}. {item.name}"
-
-            self.book.chapters.append(
-                (
-                    chap_title,
-                    [tag for tag in tags],
-                )
-            )
+        self._write_section(item, tags)
+        self.chapters.append(replace(item, hash=chapter_hash(chapter)))
+        return True
 
-            self.log_func(
-                f"Скачали {i:>{len_total}}: Том {item.volume:>{volume_len}}. Глава {item.number:>{chap_len}}. {item.name}"
-            )
+    def copy_chapter(self, item: ChapterMeta, source) -> None:
+        # Секция из прежней версии книги переносится без изменений
+        self.file.write(source.chapter(item))
+        self.chapters.append(replace(item, hash=source.hash(item)))
 
-            self.progress_bar_step(1)
+    def share_images(self, pipeline) -> None:
+        # Картинки в FB2 не попадают
+        pass
 
     def make_book(self, ranobe_data: dict) -> None:
         self.log_func("Подготавливаем книгу...")
@@ -141,7 +194,18 @@ class FB2Handler(Handler):
         book.titleInfo.lang = "ru"
         book.documentInfo.programUsed = "RanobeLIB 2 ebook"
         book.customInfos = ["meta", "rating"]
-        book.titleInfo.coverPageImages = [requests.get(ranobe_data.get("cover").get("default")).content]
+        # Обложка качается параллельно с подготовкой книги: в заголовок идёт ссылка на неё, а сама картинка - в end_book
+        self.cover = fetch_cover((ranobe_data.get("cover") or {}).get("default"))
+        self.cover_content = None
+
+        fd, self.path = tempfile.mkstemp(suffix=".fb2")
+        self.file = os.fdopen(fd, "w", encoding="utf-8")
+        self.binaries = None
+        self.min_volume = self.max_volume = ""
+        self.slug = self.branch = ""
+        self.chapters = []
+        self.metadata = book_metadata(ranobe_data)
+        self.failed_assets = 0
 
         self.log_func("Подготовили книгу.")
         self.book = book
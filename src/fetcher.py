@@ -0,0 +1,220 @@
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterator
+
+from src.api import get_chapter
+from src.branches import BranchIndex
+from src.chapters import Chapters
+from src.config import config
+from src.journal import Journal
+from src.model import ChapterData, ChapterMeta, Handler
+from src.ratelimit import AdaptiveRateLimiter
+
+
+_limiter: AdaptiveRateLimiter | None = None
+_limiter_lock = threading.Lock()
+
+
+def shared_limiter(delay: float | None = None, log_func: Callable | None = None) -> AdaptiveRateLimiter:
+    # Один ограничитель на все запросы глав: заранее скачанные главы и сама загрузка вместе не превышают
+    # допустимую скорость, а замедление после ошибок сервера действует на обе.
+    # delay - начальный интервал между запросами, с ним ограничитель создаётся заново
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None or delay:
+            rate = 1 / delay if delay else config.rate_limit
+            _limiter = AdaptiveRateLimiter(
+                rate, min(config.rate_min, rate), max(config.rate_max, rate), capacity=config.workers
+            )
+        if log_func is not None:
+            _limiter.log_func = log_func
+        return _limiter
+
+
+class Prefetch:
+    # Первые главы скачиваются заранее, пока пользователь выбирает диапазон и формат.
+    # Запросы идут по одному через общий ограничитель скорости (shared_limiter)
+    slug: str | None
+    branch: str | None
+    futures: dict[tuple[str, str], Future]
+
+    def __init__(self) -> None:
+        self.slug = None
+        self.branch = None
+        self.futures = {}
+        self.executor: ThreadPoolExecutor | None = None
+        self.lock = threading.Lock()
+
+    def start(self, slug: str, priority_branch: str, chapters_data: list[ChapterMeta]) -> None:
+        # Вызывается из интерфейса, поэтому ветки смотрим только у нескольких первых глав, а не у всего диапазона
+        planned = chapters_data[: config.prefetch_chapters]
+        index = BranchIndex(planned)
+        keys = [(str(item.volume), str(item.number)) for item in planned]
+        with self.lock:
+            # Начало диапазона и ветка не изменились: уже идущие запросы не перезапускаем
+            if slug == self.slug and str(priority_branch) == self.branch and keys == list(self.futures):
+                return
+
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+
+            for future in self.futures.values():
+                future.cancel()
+
+            self.slug = slug
+            self.branch = str(priority_branch)
+            self.futures = {}
+            limiter = shared_limiter()
+            for key, item in zip(keys, planned, strict=True):
+                branches = index.branches(item, priority_branch)
+                if branches:
+                    self.futures[key] = self.executor.submit(
+                        get_chapter, slug, branches[0], item.number, item.volume, limiter
+                    )
+
+    def take(self, slug: str, priority_branch: str, item: ChapterMeta) -> ChapterData | None:
+        with self.lock:
+            if slug != self.slug or str(priority_branch) != self.branch:
+                return None
+            future = self.futures.pop((str(item.volume), str(item.number)), None)
+
+        if future is None or future.cancelled():
+            return None
+
+        try:
+            return future.result()
+        except Exception:
+            return None
+
+
+prefetched = Prefetch()
+
+
+def fetch_chapters(
+    slug: str,
+    priority_branch: str,
+    chapters_data: list[ChapterMeta],
+    worker,
+    log_func: Callable,
+    delay: float | None = None,
+    fresh: bool = False,
+    skip: Callable[[ChapterMeta], bool] | None = None,
+) -> Iterator[tuple[int, ChapterMeta, ChapterData | None]]:
+    # delay - начальный интервал между запросами, без него продолжаем со скоростью общего ограничителя
+    # (сначала config.rate_limit запросов в секунду), дальше скорость подстраивается под ответы сервера
+    # fresh - главы запрашиваются мимо кэша (src.api.get_chapter)
+    # skip - главы, которые уже есть в обновляемой книге: их выдаём с None без запросов
+    limiter = shared_limiter(delay, log_func)
+
+    journal = Journal(slug, priority_branch)
+    if journal.done:
+        log_func(f"Продолжаем прерванную загрузку: уже скачано глав {journal.done}")
+    journal.begin(chapters_data)
+
+    index = BranchIndex(chapters_data)
+    missing = index.missing(chapters_data, priority_branch)
+    if missing:
+        log_func(f"В выбранной ветке перевода нет глав: {missing}, берём их из других веток")
+
+    def fetch(item: ChapterMeta) -> ChapterData | None:
+        chapter = journal.get(item) or prefetched.take(slug, priority_branch, item)
+        if chapter is not None:
+            return chapter
+
+        if worker.is_cancelled:
+            return None
+
+        # Главы из кэша не ждут ограничителя: он нужен только перед запросом к API.
+        # Следующая ветка запрашивается, только если в предыдущей глава не загрузилась
+        error = None
+        for branch in index.branches(item, priority_branch):
+            try:
+                chapter = get_chapter(slug, branch, item.number, item.volume, limiter, fresh)
+            except Exception as e:
+                error = e
+                continue
+
+            if branch != str(priority_branch):
+                log_func(f"Том {item.volume}. Глава {item.number} взята из ветки {branch}")
+            return chapter
+
+        log_func(str(error))
+        return None
+
+    executor = ThreadPoolExecutor(max_workers=config.workers, thread_name_prefix="chapter")
+    queue = iter(enumerate(chapters_data, 1))
+    pending: deque[tuple[int, ChapterMeta, Future]] = deque()
+    complete = False
+
+    try:
+        while True:
+            while len(pending) < config.workers and not worker.is_cancelled:
+                entry = next(queue, None)
+                if entry is None:
+                    break
+                i, item = entry
+                if skip is not None and skip(item):
+                    future = Future()
+                    future.set_result(None)
+                else:
+                    future = executor.submit(fetch, item)
+                pending.append((i, item, future))
+
+            if worker.is_cancelled:
+                break
+            if not pending:
+                complete = True
+                log_func(f"Скорость запросов к концу загрузки: {limiter.rate:.1f} в секунду")
+                break
+
+            i, item, future = pending.popleft()
+            chapter = future.result()
+            yield i, item, chapter
+
+            # Сюда возвращаемся, когда обработчик уже добавил главу в книгу
+            if chapter is not None:
+                journal.record(item, chapter)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        journal.close(complete)
+
+
+def fill_book(
+    handler: Handler,
+    slug: str,
+    priority_branch: str,
+    chapters_data: Chapters,
+    worker,
+    delay: float | None = None,
+    source=None,
+) -> None:
+    total_len, chap_len, volume_len = chapters_data.widths()
+
+    handler.begin_chapters(slug, priority_branch, chapters_data)
+    handler.log_func(f"\nНачинаем скачивать главы: {len(chapters_data)}")
+
+    # При обновлении книги прежние главы переносятся из неё без запросов, а со source.verify
+    # скачиваются заново и переносятся, только если их текст не изменился (или глава не загрузилась)
+    verify = source is not None and source.verify
+    skip = source.has if source is not None and not verify else None
+    try:
+        for i, item, chapter in fetch_chapters(
+            slug, priority_branch, chapters_data, worker, handler.log_func, delay, fresh=verify, skip=skip
+        ):
+            if source is not None and source.has(item) and (chapter is None or source.unchanged(item, chapter)):
+                handler.copy_chapter(item, source)
+                handler.progress_bar_step(1)
+                continue
+
+            if chapter is None or not handler.add_chapter(chapter, item):
+                handler.log_func("Пропускаем главу.")
+                continue
+
+            handler.log_func(
+                f"Скачали {i:>{total_len}}: "
+                f"Том {item.volume:>{volume_len}}. Глава {item.number:>{chap_len}}. {item.name}"
+            )
+            handler.progress_bar_step(1)
+    finally:
+        handler.end_chapters()
@@ -0,0 +1,138 @@
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable
+
+from src.api import download_image, image_format, resize_cover, transcode_image
+from src.cache import get_image_cache
+from src.config import config
+from src.trace import tracer
+from src.utils import is_url
+
+
+class ImagePipeline:
+    workers: int
+    queue_size: int
+
+    def __init__(self, workers: int | None = None, queue_size: int | None = None) -> None:
+        self.workers = workers or config.transcode_workers
+        self.queue_size = queue_size or config.transcode_queue
+        self.slots = threading.BoundedSemaphore(self.queue_size)
+        self.downloads = ThreadPoolExecutor(max_workers=config.workers, thread_name_prefix="image")
+        self.processes: ProcessPoolExecutor | None = None
+        self.lock = threading.Lock()
+
+    def _transcode(self, content: bytes, format: str) -> bytes:
+        # Пул процессов поднимаем только при первом промахе кэша
+        with self.lock:
+            if self.processes is None:
+                self.processes = ProcessPoolExecutor(max_workers=self.workers)
+
+        # Перекодирование идёт в другом процессе, поэтому CPU этого этапа в трассировке не виден, только ожидание
+        with tracer.span("images.transcode") as span:
+            span.bytes = len(content)
+            return self.processes.submit(transcode_image, content, format).result()
+
+    def _process(self, url: str, format: str) -> bytes:
+        try:
+            content = self._transcode(download_image(url), format)
+        finally:
+            self.slots.release()
+
+        cache = get_image_cache()
+        if cache:
+            cache.put(url, format, content)
+        return content
+
+    def submit(self, url: str, format: str) -> Future:
+        format = image_format(format)
+
+        cache = get_image_cache()
+        content = cache.get(url, format) if cache else None
+        if content is not None or not is_url(url):
+            future = Future()
+            future.set_result(content or b"")
+            return future
+
+        # Не даём очереди расти бесконечно: ждём, пока освободится место
+        self.slots.acquire()
+        return self.downloads.submit(self._process, url, format)
+
+    def close(self) -> None:
+        self.downloads.shutdown(wait=True, cancel_futures=True)
+        if self.processes is not None:
+            self.processes.shutdown(wait=True, cancel_futures=True)
+
+
+class ImageStore:
+    # Картинки книги лежат во временном файле до сохранения, в памяти только смещения
+    size: int
+
+    def __init__(self) -> None:
+        self.file = tempfile.TemporaryFile(prefix="ranobelib-images-")
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def put(self, content: bytes) -> tuple[int, int]:
+        with self.lock:
+            offset = self.size
+            self.file.seek(offset)
+            self.file.write(content)
+            self.size += len(content)
+
+        return offset, len(content)
+
+    def read(self, offset: int, length: int) -> bytes:
+        with self.lock:
+            self.file.seek(offset)
+            return self.file.read(length)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+# Обложка качается один раз на ранобе, даже если книг из одного скачивания несколько (части, форматы)
+_covers: dict[str, Future] = {}
+_covers_lock = threading.Lock()
+_cover_downloads = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cover")
+COVERS_KEPT = 4
+
+
+def _load_cover(url: str) -> bytes:
+    format = "COVER{}x{}".format(*config.cover_size)
+    cache = get_image_cache()
+    content = cache.get(url, format) if cache else None
+    if content is not None:
+        return content
+
+    content = resize_cover(download_image(url))
+    if cache:
+        cache.put(url, format, content)
+    return content
+
+
+def fetch_cover(url: str | None) -> Future | None:
+    # Скачивание начинается сразу, а ждём его только при сборке книги
+    if not url or not is_url(url):
+        return None
+
+    with _covers_lock:
+        future = _covers.get(url)
+        if future is None or (future.done() and future.exception() is not None):
+            future = _covers[url] = _cover_downloads.submit(_load_cover, url)
+            while len(_covers) > COVERS_KEPT:
+                _covers.pop(next(iter(_covers)))
+
+        return future
+
+
+def wait_cover(future: Future | None, log_func: Callable) -> bytes | None:
+    if future is None:
+        return None
+
+    try:
+        return future.result()
+    except Exception as e:
+        log_func(str(e))
+        log_func("Не удалось скачать обложку, книга будет без неё.")
+        return None
@@ -0,0 +1,153 @@
+import glob
+import json
+import os
+import threading
+from dataclasses import asdict
+
+from src.config import config
+from src.model import Attachment, ChapterData, ChapterMeta
+
+
+def _journal_dir() -> str:
+    return os.path.join(config.cache_dir, "journals")
+
+
+# По началу строки главы считаются без разбора JSON (Journal.find)
+CHAPTER_PREFIX = b'{"type": "chapter"'
+
+
+def _load_chapter(data: dict) -> ChapterData:
+    return ChapterData(**{**data, "attachments": [Attachment(**item) for item in data.get("attachments", [])]})
+
+
+class Journal:
+    slug: str
+    branch: str
+    path: str
+    start: tuple[str, str] | None
+    end: tuple[str, str] | None
+    total: int
+    done: int
+    chapters: dict[tuple[str, str], tuple[int, int]]
+
+    def __init__(self, slug: str, branch: str, summary: bool = False) -> None:
+        # Главы в памяти не держим, только (том, глава) -> (смещение, длина) их строки в журнале.
+        # summary - только диапазон и число скачанных глав, без разбора самих глав
+        self.slug = slug
+        self.branch = str(branch)
+        self.path = os.path.join(_journal_dir(), f"{slug}_{self.branch}.jsonl")
+        self.start = None
+        self.end = None
+        self.total = 0
+        self.done = 0
+        self.chapters = {}
+        self.lock = threading.Lock()
+        self.file = None
+
+        self._read(summary)
+
+    def _read(self, summary: bool) -> None:
+        if not os.path.exists(self.path):
+            return
+
+        offset = 0
+        with open(self.path, "rb") as file:
+            for line in file:
+                line_offset, offset = offset, offset + len(line)
+                # Последняя строка могла оборваться при падении
+                if not line.endswith(b"\n"):
+                    continue
+
+                if line.startswith(CHAPTER_PREFIX) and summary:
+                    self.done += 1
+                    continue
+
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+
+                match record.get("type"):
+                    case "start":
+                        self.start = tuple(record["start"])
+                        self.end = tuple(record["end"])
+                        self.total = record["total"]
+                    case "chapter":
+                        self.chapters[(record["volume"], record["number"])] = (line_offset, len(line))
+
+        if not summary:
+            self.done = len(self.chapters)
+
+    @classmethod
+    def find(cls, slug: str) -> "Journal | None":
+        paths = glob.glob(os.path.join(glob.escape(_journal_dir()), f"{glob.escape(slug)}_*.jsonl"))
+        if not paths:
+            return None
+
+        branch = os.path.basename(max(paths, key=os.path.getmtime))[len(slug) + 1 : -len(".jsonl")]
+        journal = cls(slug, branch, summary=True)
+        return journal if journal.start is not None and journal.done else None
+
+    def get(self, item: ChapterMeta) -> ChapterData | None:
+        position = self.chapters.get((str(item.volume), str(item.number)))
+        if position is None:
+            return None
+
+        offset, length = position
+        with open(self.path, "rb") as file:
+            file.seek(offset)
+            return _load_chapter(json.loads(file.read(length))["data"])
+
+    def _write(self, record: dict) -> tuple[int, int]:
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode()
+        with self.lock:
+            if self.file is None:
+                os.makedirs(_journal_dir(), exist_ok=True)
+                self.file = open(self.path, "ab+")
+                # Оборванную при падении строку закрываем, чтобы она не склеилась со следующей
+                size = self.file.seek(0, os.SEEK_END)
+                if size:
+                    self.file.seek(size - 1)
+                    if self.file.read(1) != b"\n":
+                        self.file.write(b"\n")
+
+            offset = self.file.seek(0, os.SEEK_END)
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        return offset, len(line)
+
+    def begin(self, chapters_data: list[ChapterMeta]) -> None:
+        self.start = (str(chapters_data[0].volume), str(chapters_data[0].number))
+        self.end = (str(chapters_data[-1].volume), str(chapters_data[-1].number))
+        self.total = len(chapters_data)
+        self._write(
+            {
+                "type": "start",
+                "slug": self.slug,
+                "branch": self.branch,
+                "start": self.start,
+                "end": self.end,
+                "total": self.total,
+            }
+        )
+
+    def record(self, item: ChapterMeta, chapter: ChapterData) -> None:
+        key = (str(item.volume), str(item.number))
+        if key in self.chapters:
+            return
+
+        self.chapters[key] = self._write(
+            {"type": "chapter", "volume": key[0], "number": key[1], "name": item.name, "data": asdict(chapter)}
+        )
+        self.done = len(self.chapters)
+
+    def close(self, complete: bool) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+            # Журнал нужен только для незаконченной загрузки
+            if complete and os.path.exists(self.path):
+                os.remove(self.path)
@@ -1,4 +1,6 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 from typing import Literal
 from urllib.parse import urlparse
@@ -6,7 +8,7 @@ from urllib.parse import urlparse
 import pyperclip
 from textual import on, work
 from textual.app import App, ComposeResult
-from textual.validation import Function
+from textual.validation import Function, Number
 from textual.binding import Binding
 from textual.containers import Horizontal, VerticalScroll, Vertical
 from textual.worker import Worker, get_current_worker
@@ -26,10 +28,16 @@ from textual.widgets import (
 
 from textual_fspicker import SelectDirectory
 
+from src.chapters import Chapters
 from src.config import config
-from src.model import ChapterMeta, Handler, State
+from src.model import Handler, State
 from src.api import get_branchs, get_chapters_data, get_ranobe_data
-from src.utils import is_jwt, is_valid_url
+from src.fetcher import prefetched
+from src.images import fetch_cover
+from src.journal import Journal
+from src.split import SplitHandler
+from src.utils import is_jwt, is_valid_url, parse_chapter_key, slug_id
+from src.widgets import ChapterList, UiUpdates
 
 title = r"""
      ____                   _          _     ___ ____    ____         _                 _    
@@ -40,15 +48,26 @@ title = r"""
         """
 
 
+def is_chapter_key(value: str) -> bool:
+    return parse_chapter_key(value) is not None
+
+
+# Подсказка и значение по умолчанию для размера части
+SPLIT_LIMITS = {"chapters": ("Глав в книге", "100"), "size": ("МиБ текста в книге", "5")}
+
+
 class Ranobe2ebook(App):
     CSS_PATH = "../style.tcss"
     slug: str
     ranobe_data: dict
-    chapters_data: list[ChapterMeta]
+    chapters_data: Chapters
     priority_branch: str
     dir: str = os.path.normpath(os.path.expanduser("~/Desktop"))
-    start: int
-    amount: int
+    # Как --split-chapters и --split-size в src.cli: число глав или размер в МиБ
+    split_limit: float = 100
+    # Выбранный диапазон глав и его первая глава (том, глава)
+    selected: Chapters | None = None
+    selected_start: tuple[str, str] | None = None
     state: State = State()
     ebook: Handler = None
     cd_error_link: int = 0
@@ -57,10 +76,11 @@ class Ranobe2ebook(App):
     def __init__(
         self,
         *,
-        handlers: dict[Literal["fb2", "epub"], Handler],
+        handlers: dict[Literal["fb2", "epub", "epub_stream", "epub_fb2"], Handler],
     ) -> None:
         super().__init__()
         self.handlers = handlers
+        self.updates = UiUpdates()
 
     BINDINGS = [
         Binding(key="ctrl+q", action="quit", key_display="ctrl + q", description="Выйти"),
@@ -124,7 +144,24 @@ class Ranobe2ebook(App):
                             yield Label("Формат")
                             yield Rule(line_style="heavy")
                             yield RadioButton("EPUB с картинками 📝 + 🖼", name="epub", value=True)
+                            yield RadioButton("EPUB с картинками, экономия памяти 📝 + 🖼", name="epub_stream")
                             yield RadioButton("FB2 без картинок 📝", name="fb2")
+                            yield RadioButton("EPUB и FB2 за одно скачивание 📝 + 🖼", name="epub_fb2")
+                        with RadioSet(id="split", classes="w-full mb-1"):
+                            yield Label("Разбить книгу")
+                            yield Rule(line_style="heavy")
+                            yield RadioButton("Одной книгой", name="none", value=True)
+                            yield RadioButton("Отдельная книга на каждый том", name="volume")
+                            yield RadioButton("По N глав в книге", name="chapters")
+                            yield RadioButton("По размеру текста глав, МиБ", name="size")
+                            yield Input(
+                                "100",
+                                placeholder="Глав в книге",
+                                id="input_split_limit",
+                                type="number",
+                                disabled=True,
+                                validators=[Number(minimum=0.01)],
+                            )
                         with RadioSet(id="save_dir", classes="w-full mb-1"):
                             yield Label("Сохранить в папку")
                             yield Rule(line_style="heavy")
@@ -142,25 +179,33 @@ class Ranobe2ebook(App):
                         with Horizontal(classes=""):
                             yield Input(
                                 id="input_start",
-                                placeholder="C",
-                                type="integer",
+                                placeholder="С главы, ТОМ:ГЛАВА",
                                 disabled=True,
                                 classes="w-frame",
+                                validators=[Function(is_chapter_key, "Нужно в виде ТОМ:ГЛАВА")],
                             )
                             yield Input(
                                 id="input_end",
-                                placeholder="Кол-во",
-                                type="integer",
+                                placeholder="По главу, ТОМ:ГЛАВА",
                                 disabled=True,
                                 classes="w-frame",
+                                validators=[Function(is_chapter_key, "Нужно в виде ТОМ:ГЛАВА")],
                             )
                         yield Label("", id="chapters_count", classes="w-full m1-2")
 
-                        yield Log(id="log")
-                        yield Log(
-                            id="chapter_list",
-                            auto_scroll=False,
-                        )
+                        yield Log(id="log", max_lines=config.ui_log_lines)
+                        yield ChapterList(id="chapter_list")
+
+    def on_mount(self) -> None:
+        self.set_interval(1 / config.ui_fps, self.flush_updates)
+
+    def flush_updates(self) -> None:
+        # Сообщения и прогресс из потоков скачивания выводим одной пачкой за кадр
+        lines, steps = self.updates.drain()
+        if lines:
+            self.query_one("#log").write_lines(lines)
+        if steps:
+            self.query_one("#download_progress").advance(steps)
 
     @on(Input.Changed, "#input_link")
     def show_invalid_reasons(self, event: Input.Changed) -> None:
@@ -189,118 +234,155 @@ class Ranobe2ebook(App):
             self.dir = event.value
             self.state.is_dir_selected = True
 
-    @on(Input.Changed, "#input_start")
-    def show_from_chapter(self, event: Input.Changed) -> None:
+    @on(Input.Changed, "#input_split_limit")
+    def set_split_limit(self, event: Input.Changed) -> None:
         if event.validation_result.is_valid:
-            start: int = int(event.value)
-            end: Input = self.query_one("#input_end")
-
-            p_bar: ProgressBar = self.query_one("#download_progress")
-
-            if end.value not in ("", None):
-                start = start - 1
-
-                amount = int(end.value)
-                tmp = self.chapters_data[start : start + amount]
-                len_tmp = len(tmp)
-                if len_tmp != 0:
-                    p_bar.update(total=len_tmp)
-                    self.start = start
-                    self.query_one("#chapters_count").update(
-                        f"С: Том {tmp[0].volume}. Глава {tmp[0].number}. По: Том {tmp[-1].volume}. Глава {tmp[-1].number}. - глав: {len_tmp}."
-                    )
+            self.split_limit = float(event.value)
 
+    @on(Input.Changed, "#input_start")
     @on(Input.Changed, "#input_end")
-    def show_to_chapter(self, event: Input.Changed) -> None:
-        if event.validation_result.is_valid:
-            end: int = int(event.value)
-            start: Input = self.query_one("#input_start")
-
-            p_bar: ProgressBar = self.query_one("#download_progress")
-
-            if start.value not in ("", None):
-                start = int(start.value)
-                start = start - 1
-                amount = end
+    def select_range(self, event: Input.Changed) -> None:
+        # Границы диапазона ищутся по (том, глава) в списке глав, а не по позиции:
+        # первой берётся глава не раньше начала, последней - глава конца или последняя перед ним
+        start = parse_chapter_key(self.query_one("#input_start").value)
+        end = parse_chapter_key(self.query_one("#input_end").value)
+        if start is None or end is None:
+            return
 
-                tmp = self.chapters_data[start : start + amount]
-                len_tmp = len(tmp)
+        selected = self.chapters_data.between(start, end)
+        self.state.is_chapters_selected = bool(self.show_range(selected))
+        if not selected:
+            return
 
-                if len_tmp != 0:
-                    p_bar.update(total=len_tmp)
-                    self.amount = amount
-                    self.query_one("#chapters_count").update(
-                        f"С: Том {tmp[0].volume}. Глава {tmp[0].number}. По: Том {tmp[-1].volume}. Глава {tmp[-1].number}. - глав: {len_tmp}."
-                    )
+        self.selected = selected
+        if start != self.selected_start:
+            self.selected_start = start
+            # Заранее скачиваем первые главы нового диапазона
+            if self.state.is_branch_selected and not self.query_one("#download").disabled:
+                self.prefetch()
+
+    def show_range(self, chapters: Chapters) -> int:
+        if not chapters:
+            self.query_one("#chapters_count").update("В выбранном диапазоне нет глав.")
+            return 0
+
+        first, last = chapters[0], chapters[-1]
+        self.query_one("#download_progress").update(total=len(chapters))
+        self.query_one("#chapters_count").update(
+            f"С: Том {first.volume}. Глава {first.number}. "
+            f"По: Том {last.volume}. Глава {last.number}. - глав: {len(chapters)}."
+        )
+        return len(chapters)
 
     @on(Button.Pressed, "#check_link")
     def check_link(self, event: Button.Pressed) -> None:
-        log: Log = self.query_one("#log")
-
         self.dev_print("Check link")
         self.clear_all()
 
         url = urlparse(self.query_one("#input_link").value)
         self.slug = url.path.split("/")[-1]
 
-        log.write_line("Получаем данные о ранобе...")
-        self.ranobe_data = get_ranobe_data(self.slug)
-        if self.ranobe_data is None:
-            log.write_line("Не удалось получить данные о ранобе.")
-            log.write_line("Либо такого ранобє нету, либо для него требуется авторизация.")
-            log.write_line("Если вы уже авторизовивались, сделайте это еще раз.")
+        self.query_one("#check_link").disabled = True
+        self.query_one("#download").disabled = True
+        self.check_link_worker()
+
+    @work(name="check_link_worker", exclusive=True, thread=True)
+    async def check_link_worker(self) -> None:
+        log = self.updates.log
+
+        # Запросы идут одновременно: id для веток берём из slug, а список глав ждёт только chap_count
+        log("Получаем данные о ранобе, ветви перевода и список глав...")
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix="check") as executor:
+            ranobe_future = executor.submit(get_ranobe_data, self.slug)
+            id = slug_id(self.slug)
+            branchs_future = executor.submit(get_branchs, id) if id else None
+            chapters_future = executor.submit(
+                lambda: get_chapters_data(self.slug, (ranobe_future.result() or {}).get("chap_count"))
+            )
+
+            try:
+                ranobe_data = ranobe_future.result()
+            except Exception as e:
+                log(str(e))
+                ranobe_data = None
+
+            if ranobe_data is None:
+                log("Не удалось получить данные о ранобе.")
+                log("Либо такого ранобє нету, либо для него требуется авторизация.")
+                log("Если вы уже авторизовивались, сделайте это еще раз.")
+                self.call_from_thread(self.enable_check_link)
+                return
+            log("Получили данные о ранобе.")
+            # Обложка скачивается, пока выбирают диапазон и формат
+            fetch_cover((ranobe_data.get("cover") or {}).get("default"))
+
+            try:
+                if branchs_future is None:
+                    branchs_future = executor.submit(get_branchs, ranobe_data.get("id"))
+                branchs = branchs_future.result()
+            except Exception as e:
+                log(str(e))
+                branchs = None
+
+            if branchs is None or len(branchs) == 0:
+                log("Не удалось получить список ветвей перевода. \nБудет использоватся главная ветвь.")
+            else:
+                log("Получили список ветвей перевода.")
+
+            try:
+                chapters_data = chapters_future.result()
+            except Exception as e:
+                log(str(e))
+                chapters_data = None
+
+        if chapters_data is None:
+            log("Не удалось получить список глав.")
+            self.call_from_thread(self.enable_check_link)
             return
-        log.write_line("Получили данные о ранобе.")
+        log("Получили список глав.")
 
-        log.write_line("\nПолучаем список ветвей перевода...")
-        branchs = get_branchs(self.ranobe_data.get("id"))
+        self.call_from_thread(self.show_link_data, ranobe_data, branchs or [], chapters_data)
 
-        if branchs is None or len(branchs) == 0:
-            log.write_line("Не удалось получить список ветвей перевода. \nБудет использоватся главная ветвь.")
-        else:
-            log.write_line("Получили список ветвей перевода.")
+    def enable_check_link(self) -> None:
+        self.query_one("#check_link").disabled = False
+
+    def show_link_data(self, ranobe_data: dict, branchs: list[dict], chapters_data: Chapters) -> None:
+        self.enable_check_link()
+        self.ranobe_data = ranobe_data
+        self.chapters_data = chapters_data
 
         options: list[tuple[str, str]] = []
-        for i, branch in enumerate(branchs):
-            options.append(
-                (
-                    f"{branch.get('name')}. Переводчики: {' & '.join([team.get('name') for team in branch.get('teams')])}",
-                    str(branch.get("id")),
-                )
-            )
+        for branch in branchs:
+            teams = " & ".join([team.get("name") for team in branch.get("teams")])
+            options.append((f"{branch.get('name')}. Переводчики: {teams}", str(branch.get("id"))))
 
         if len(options) == 0:
             options = [("Main branch", "0")]
-            self.query_one("#branch_list").set_options(options)
-            self.query_one("#branch_list").value = options[0][1]
-        else:
-            self.query_one("#branch_list").set_options(options)
-            self.query_one("#branch_list").value = options[0][1]
-
-        log.write_line("\nПолучаем список глав...")
-        self.chapters_data = get_chapters_data(self.slug)
-        if self.chapters_data is None:
-            log.write_line("Не удалось получить список глав.")
-            return
+        self.query_one("#branch_list").set_options(options)
+        self.query_one("#branch_list").value = options[0][1]
 
         self.state.is_data_loaded = True
-        log.write_line("Получили список глав.")
 
-        self.query_one("#input_start").value = "1"
-        self.query_one("#input_end").value = str(len(self.chapters_data))
+        first, last = self.chapters_data[0], self.chapters_data[-1]
+        self.query_one("#input_start").value = f"{first.volume}:{first.number}"
+        self.query_one("#input_end").value = f"{last.volume}:{last.number}"
 
-        total_len = len(str(len(self.chapters_data)))
-        chap_len = len(str(max(self.chapters_data, key=lambda x: len(str(x.number))).number))
-        volume_len = len(str(self.chapters_data[-1].volume))
+        self.query_one("#chapter_list").set_chapters(self.chapters_data)
 
-        self.query_one("#chapter_list").write_lines(
-            [
-                f"{i:>{total_len}}: Том {chapter.volume:>{volume_len}}. Глава {chapter.number:>{chap_len}}. {chapter.name}"
-                for i, chapter in enumerate(self.chapters_data, 1)
-            ]
-        )
+        journal = Journal.find(self.slug)
+        if journal is not None:
+            found = self.chapters_data.find(*journal.start), self.chapters_data.find(*journal.end)
+            if None not in found:
+                self.updates.log(
+                    f"\nНайдена незавершённая загрузка: скачано глав {journal.done} из {journal.total}."
+                )
+                self.updates.log("Диапазон и ветка перевода восстановлены. Нажмите «Скачать», чтобы продолжить.")
+                self.query_one("#input_start").value = ":".join(journal.start)
+                self.query_one("#input_end").value = ":".join(journal.end)
+                if journal.branch in [value for _, value in options]:
+                    self.query_one("#branch_list").value = journal.branch
 
-        log.write_line("\nГотовы к скачиванию!")
+        self.updates.log("\nГотовы к скачиванию!")
 
         self.state.is_chapters_selected = True
         dir_radio_set: RadioSet = self.query_one("#save_dir")
@@ -311,6 +393,12 @@ class Ranobe2ebook(App):
         self.query_one("#download").disabled = False
         self.query_one("#input_start").disabled = False
         self.query_one("#input_end").disabled = False
+        self.query_one("#input_split_limit").disabled = self.query_one("#split").pressed_button.name not in SPLIT_LIMITS
+
+    def prefetch(self) -> None:
+        # Пока выбирают диапазон и формат, первые главы выбранной ветки уже скачиваются
+        chapters = self.selected if self.selected is not None else self.chapters_data
+        prefetched.start(self.slug, self.priority_branch, chapters)
 
     @on(Button.Pressed, "#paste_token")
     def paste_token(self, event: Button.Pressed) -> None:
@@ -339,53 +427,50 @@ class Ranobe2ebook(App):
 
     @work(name="make_ebook_worker", exclusive=True, thread=True)
     async def make_ebook_worker(self) -> None:
-        log: Log = self.query_one("#log")
-        p_bar: ProgressBar = self.query_one("#download_progress")
-
         format = self.query_one("#format").pressed_button.name
 
         Handler_: Handler = self.handlers[format]
 
-        self.ebook = Handler_(log_func=log.write_line, progress_bar_step=p_bar.advance)
+        # Части сохраняются сразу, как только скачаны их главы
+        split = self.query_one("#split").pressed_button.name
+        if split != "none":
+            limit = int(self.split_limit) if split == "chapters" else int(self.split_limit * 1024 * 1024)
+            Handler_ = partial(SplitHandler, handler_type=Handler_, dir=self.dir, by=split, limit=max(limit, 1))
+
+        self.ebook = Handler_(log_func=self.updates.log, progress_bar_step=self.updates.advance)
 
         try:
             self.ebook.make_book(self.ranobe_data)
 
         except Exception as e:
-            log.write_line(str(e))
+            self.updates.log(str(e))
 
     @work(name="fill_ebook_worker", exclusive=True, thread=True)
     async def fill_ebook_worker(self) -> None:
-        log: Log = self.query_one("#log")
         self.query_one("#stop_and_save").disabled = False
         try:
             worker = get_current_worker()
-            self.ebook.fill_book(
-                self.slug, self.priority_branch, self.chapters_data[self.start : self.start + self.amount], worker
-            )
+            self.ebook.fill_book(self.slug, self.priority_branch, self.selected, worker)
 
         except Exception as e:
-            log.write_line(str(e))
+            self.updates.log(str(e))
 
     @work(name="end_ebook_worker", exclusive=True, thread=True)
     async def end_ebook_worker(self) -> None:
-        log: Log = self.query_one("#log")
         self.query_one("#stop_and_save").disabled = True
         try:
             self.ebook.end_book()
 
         except Exception as e:
-            log.write_line(str(e))
+            self.updates.log(str(e))
 
     @work(name="save_ebook_worker", exclusive=True, thread=True)
     async def save_ebook_worker(self) -> None:
-        log: Log = self.query_one("#log")
-
         try:
-            log.write_line("\nСохраняем книгу...")
+            self.updates.log("\nСохраняем книгу...")
             self.ebook.save_book(self.dir)
         except Exception as e:
-            log.write_line(str(e))
+            self.updates.log(str(e))
         self.query_one("#check_link").disabled = False
 
     @on(Worker.StateChanged)
@@ -412,6 +497,7 @@ class Ranobe2ebook(App):
             self.query_one("#check_link").disabled = True
             self.query_one("#input_start").disabled = True
             self.query_one("#input_end").disabled = True
+            self.query_one("#input_split_limit").disabled = True
 
             self.make_ebook_worker()
         else:
@@ -427,10 +513,17 @@ class Ranobe2ebook(App):
             self.state.is_branch_selected = True
             self.priority_branch = event.select.value
             self.dev_print(event.select.value)
+            if self.state.is_data_loaded and not self.query_one("#download").disabled:
+                self.prefetch()
 
     @on(RadioSet.Changed)
     def set_option(self, event: RadioSet.Changed) -> None:
         match event.radio_set.id:
+            case "split":
+                split_limit: Input = self.query_one("#input_split_limit")
+                split_limit.disabled = event.radio_set.pressed_button.name not in SPLIT_LIMITS
+                if not split_limit.disabled:
+                    split_limit.placeholder, split_limit.value = SPLIT_LIMITS[event.radio_set.pressed_button.name]
             case "save_dir":
                 self.dev_print(event.radio_set.pressed_button.label)
                 self.query_one("#input_save_dir").disabled = True
@@ -470,3 +563,5 @@ class Ranobe2ebook(App):
         self.query_one("#branch_list").set_options([])
         self.query_one("#input_start").clear()
         self.query_one("#input_end").clear()
+        self.selected = None
+        self.selected_start = None
@@ -1,6 +1,10 @@
+import os
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
-from typing import Any, Callable, Literal
+from datetime import datetime, timezone
+from typing import Callable, Literal
+
+from src.trace import traced
 
 
 @dataclass
@@ -30,6 +34,9 @@ class ChapterMeta:
     name: str
     number: int
     volume: int
+    branches: list[str] = field(default_factory=list)
+    # Хэш содержимого главы (src.utils.chapter_hash), хранится в книге для её обновления
+    hash: str = ""
 
 
 @dataclass
@@ -53,6 +60,13 @@ class ChapterData:
     attachments: list[Attachment] = field(default_factory=list)
 
 
+@dataclass
+class BookMeta:
+    slug: str
+    branch: str
+    chapters: list[ChapterMeta]
+
+
 @dataclass
 class Exception:
     message: str
@@ -61,6 +75,47 @@ class Exception:
 @dataclass
 class Config:
     token: str = ""
+    api_url: str = "https://api.lib.social"
+    site_url: str = "https://ranobelib.me"
+    workers: int = 4
+    rate_limit: float = 4.0
+    rate_min: float = 0.5
+    rate_max: float = 20.0
+    rate_increase: float = 1.0
+    rate_backoff: float = 0.5
+    retries: int = 5
+    retry_after_max: float = 60.0
+    pool_size: int = 8
+    timeout: float = 30.0
+    cache_enabled: bool = True
+    cache_dir: str = os.path.join(os.path.expanduser("~"), "Documents", "ranobelib-parser-cache")
+    cache_max_size: int = 512 * 1024 * 1024
+    cache_ttl: float = 30 * 24 * 60 * 60
+    chapters_list_ttl: float = 24 * 60 * 60
+    image_cache_max_size: int = 1024 * 1024 * 1024
+    transcode_workers: int = os.cpu_count() or 1
+    transcode_queue: int = 32
+    split_workers: int = 2
+    split_queue: int = 64
+    ui_fps: int = 10
+    ui_log_lines: int = 5000
+    prefetch_chapters: int = 5
+    cover_size: tuple[int, int] = (1000, 1500)
+    cover_quality: int = 85
+    # Дата изменения в метаданных книги и в архиве EPUB (src.reproducible)
+    book_time: datetime = datetime(1980, 1, 1, tzinfo=timezone.utc)
+
+
+TRACED_METHODS = (
+    "make_book",
+    "fill_book",
+    "_make_chapter",
+    "add_chapter",
+    "copy_chapter",
+    "end_book",
+    "save_book",
+    "save_book_as",
+)
 
 
 class Handler(ABC):
@@ -71,9 +126,22 @@ class Handler(ABC):
         self.log_func = log_func
         self.progress_bar_step = progress_bar_step
 
+    def __init_subclass__(cls, **kwargs) -> None:
+        # Этапы жизненного цикла попадают в трассировку (src.trace) под именем "Класс.метод"
+        super().__init_subclass__(**kwargs)
+        for name in TRACED_METHODS:
+            if name in cls.__dict__:
+                setattr(cls, name, traced(f"{cls.__name__}.{name}")(cls.__dict__[name]))
+
     @abstractmethod
     def fill_book(
-        self, slug: str, priority_branch: str, chapters_data: list[ChapterMeta], worker, delay: float = 0.5
+        self,
+        slug: str,
+        priority_branch: str,
+        chapters_data: list[ChapterMeta],
+        worker,
+        delay: float | None = None,
+        source=None,
     ) -> None:
         pass
 
@@ -81,8 +149,27 @@ class Handler(ABC):
     def make_book(self, ranobe_data: dict) -> None:
         pass
 
+    # Общий цикл скачивания (src.fetcher.fill_book) передаёт главы формату через эти методы
+    @abstractmethod
+    def begin_chapters(self, slug: str, priority_branch: str, chapters_data: list[ChapterMeta]) -> None:
+        pass
+
+    @abstractmethod
+    def add_chapter(self, chapter: ChapterData, item: ChapterMeta) -> bool:
+        pass
+
+    # Перенос главы из обновляемой книги (src.update), source - BookSource того же формата
+    @abstractmethod
+    def copy_chapter(self, item: ChapterMeta, source) -> None:
+        pass
+
+    def end_chapters(self) -> None:
+        pass
+
+    # Общий пул обработки картинок (src.images.ImagePipeline) для нескольких книг одного скачивания,
+    # его закрывает тот, кто передал
     @abstractmethod
-    def _make_chapter(self, slug: str, priority_branch: str, item: ChapterMeta) -> Any:
+    def share_images(self, pipeline) -> None:
         pass
 
     @abstractmethod
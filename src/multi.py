@@ -0,0 +1,72 @@
+from typing import Callable
+
+from src.epub import EpubHandler
+from src.fb2 import FB2Handler
+from src.fetcher import fill_book
+from src.model import ChapterData, ChapterMeta, Handler
+
+
+class MultiHandler(Handler):
+    handler_types: tuple[type[Handler], ...] = ()
+    handlers: list[Handler]
+
+    def __init__(
+        self,
+        log_func: Callable,
+        progress_bar_step: Callable,
+        handler_types: tuple[type[Handler], ...] | None = None,
+    ) -> None:
+        super().__init__(log_func, progress_bar_step)
+
+        # Главы скачиваются один раз и раздаются всем форматам, прогресс считаем по главам, а не по форматам
+        self.handlers = [
+            handler(log_func=log_func, progress_bar_step=lambda step: None)
+            for handler in handler_types or self.handler_types
+        ]
+
+    def make_book(self, ranobe_data: dict) -> None:
+        for handler in self.handlers:
+            handler.make_book(ranobe_data)
+
+    def fill_book(
+        self,
+        slug: str,
+        priority_branch: str,
+        chapters_data: list[ChapterMeta],
+        worker,
+        delay: float | None = None,
+        source=None,
+    ) -> None:
+        fill_book(self, slug, priority_branch, chapters_data, worker, delay, source)
+
+    def begin_chapters(self, slug: str, priority_branch: str, chapters_data: list[ChapterMeta]) -> None:
+        for handler in self.handlers:
+            handler.begin_chapters(slug, priority_branch, chapters_data)
+
+    def add_chapter(self, chapter: ChapterData, item: ChapterMeta) -> bool:
+        added = [handler.add_chapter(chapter, item) for handler in self.handlers]
+        return any(added)
+
+    def copy_chapter(self, item: ChapterMeta, source) -> None:
+        for handler in self.handlers:
+            handler.copy_chapter(item, source)
+
+    def end_chapters(self) -> None:
+        for handler in self.handlers:
+            handler.end_chapters()
+
+    def share_images(self, pipeline) -> None:
+        for handler in self.handlers:
+            handler.share_images(pipeline)
+
+    def end_book(self) -> None:
+        for handler in self.handlers:
+            handler.end_book()
+
+    def save_book(self, dir: str) -> None:
+        for handler in self.handlers:
+            handler.save_book(dir)
+
+
+class EpubFB2Handler(MultiHandler):
+    handler_types = (EpubHandler, FB2Handler)
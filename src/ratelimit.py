@@ -0,0 +1,105 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable
+
+import requests
+
+from src.config import config
+
+
+# Ответы, после которых сервер стоит разгрузить и повторить запрос
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+def retry_after(response: requests.Response | None) -> float | None:
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+
+    return min(max(seconds, 0.0), config.retry_after_max)
+
+
+class AdaptiveRateLimiter:
+    rate: float
+    min_rate: float
+    max_rate: float
+    capacity: int
+    tokens: float
+
+    def __init__(
+        self,
+        rate: float,
+        min_rate: float,
+        max_rate: float,
+        capacity: int = 1,
+        log_func: Callable | None = None,
+    ) -> None:
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.log_func = log_func
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.decreased = 0.0
+        self.slow_start = True
+        self.reported = rate
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+
+                    wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+    def success(self) -> None:
+        with self.lock:
+            # До первой ошибки скорость растёт экспоненциально, потом аддитивно:
+            # примерно на rate_increase запросов/с каждую секунду
+            increase = config.rate_increase if self.slow_start else config.rate_increase / self.rate
+            self.rate = min(self.max_rate, self.rate + increase)
+            if self.rate >= self.reported * 1.5:
+                self._report(f"Сервер отвечает без ошибок, ускоряемся до {self.rate:.1f} запросов/с")
+
+    def throttle(self, pause: float | None = None) -> None:
+        with self.lock:
+            now = time.monotonic()
+
+            # Пачка ошибок от запросов, отправленных ещё на старой скорости, снижает её только один раз
+            if now - self.decreased >= 1.0:
+                self.decreased = now
+                self.slow_start = False
+                self.rate = max(self.min_rate, self.rate * config.rate_backoff)
+                self._report(f"Сервер не справляется, снижаем скорость до {self.rate:.1f} запросов/с")
+
+            if pause:
+                self.paused_until = max(self.paused_until, now + pause)
+                self.updated = self.paused_until
+                self.tokens = 0.0
+
+    def _report(self, message: str) -> None:
+        self.reported = self.rate
+        if self.log_func is not None:
+            self.log_func(message)
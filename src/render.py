@@ -0,0 +1,461 @@
+from html import escape
+from html.parser import HTMLParser
+from typing import Callable, Iterable
+from xml.etree import ElementTree as ET
+
+
+# Промежуточный поток узлов общий для EPUB и FB2:
+#   ("start", tag, attrs) / ("end", tag) / ("text", text) / ("image", name) / ("rule",) / ("break",)
+# Теги нейтральные: p, h, quote, ul, ol, li, strong, em, u, s, sub, sup, code, a
+Event = tuple
+
+MARKS: dict[str, str] = {
+    "bold": "strong",
+    "italic": "em",
+    "underline": "u",
+    "strike": "s",
+    "subscript": "sub",
+    "superscript": "sup",
+    "code": "code",
+    "link": "a",
+}
+
+BLOCKS: dict[str, str] = {
+    "paragraph": "p",
+    "heading": "h",
+    "blockquote": "quote",
+    "bulletList": "ul",
+    "orderedList": "ol",
+    "listItem": "li",
+}
+
+
+# События разметки общие для всех узлов, кроме ссылок: у них свой href
+MARK_EVENTS: dict[str, tuple[Event, Event]] = {
+    type: (("start", tag, {}), ("end", tag)) for type, tag in MARKS.items() if tag != "a"
+}
+
+
+def _render_children(node: dict, out: list[Event]) -> None:
+    for child in node.get("content") or ():
+        NODE_RENDERERS.get(child.get("type"), _render_children)(child, out)
+
+
+def _render_block(node: dict, out: list[Event]) -> None:
+    tag = BLOCKS[node["type"]]
+    attrs = node.get("attrs") or {}
+    out.append(("start", tag, {"level": attrs.get("level") or 2} if tag == "h" else {}))
+    _render_children(node, out)
+    out.append(("end", tag))
+
+
+def _render_paragraph(node: dict, out: list[Event]) -> None:
+    # Текстовые узлы абзаца разбираем на месте, без вызова функции на каждый
+    append = out.append
+    append(("start", "p", {}))
+    for child in node.get("content") or ():
+        if child.get("type") == "text":
+            if child.get("marks"):
+                _render_text(child, out)
+            else:
+                append(("text", child.get("text", "")))
+        else:
+            NODE_RENDERERS.get(child.get("type"), _render_children)(child, out)
+    append(("end", "p"))
+
+
+def _render_text(node: dict, out: list[Event]) -> None:
+    marks = node.get("marks")
+    if not marks:
+        out.append(("text", node.get("text", "")))
+        return
+
+    ends: list[Event] = []
+    for mark in marks:
+        type = mark.get("type")
+        events = MARK_EVENTS.get(type)
+        if events is not None:
+            out.append(events[0])
+            ends.append(events[1])
+        elif type == "link":
+            out.append(("start", "a", {"href": (mark.get("attrs") or {}).get("href", "")}))
+            ends.append(("end", "a"))
+
+    out.append(("text", node.get("text", "")))
+    ends.reverse()
+    out.extend(ends)
+
+
+def _render_image(node: dict, out: list[Event]) -> None:
+    images = (node.get("attrs") or {}).get("images") or []
+    if images:
+        out.append(("image", images[-1].get("image")))
+
+
+def _render_rule(node: dict, out: list[Event]) -> None:
+    out.append(("rule",))
+
+
+def _render_break(node: dict, out: list[Event]) -> None:
+    out.append(("break",))
+
+
+NODE_RENDERERS: dict[str, Callable[[dict, list[Event]], None]] = {
+    **{type: _render_block for type in BLOCKS},
+    "paragraph": _render_paragraph,
+    "text": _render_text,
+    "image": _render_image,
+    "horizontalRule": _render_rule,
+    "hardBreak": _render_break,
+}
+
+
+def render_doc(content: list[dict]) -> list[Event]:
+    out: list[Event] = []
+    _render_children({"content": content}, out)
+    return out
+
+
+# Абзац из одного текста без разметки - так выглядит почти вся doc-глава. Такие абзацы doc_to_xhtml
+# и doc_to_fb2 пишут сразу, без потока событий: его разбор дороже самого абзаца. Проверка
+# повторена в обоих циклах, вызов функции на каждый абзац заметно их замедляет
+EMPTY_PARAGRAPH = ({"type": "text", "text": ""},)
+
+
+# HTML-главы разбираем в тот же поток за один проход; неизвестные теги (div, span, font) прозрачны
+HTML_TAGS: dict[str, str] = {
+    "p": "p",
+    "h1": "h",
+    "h2": "h",
+    "h3": "h",
+    "h4": "h",
+    "h5": "h",
+    "h6": "h",
+    "blockquote": "quote",
+    "ul": "ul",
+    "ol": "ol",
+    "li": "li",
+    "strong": "strong",
+    "b": "strong",
+    "em": "em",
+    "i": "em",
+    "u": "u",
+    "s": "s",
+    "strike": "s",
+    "del": "s",
+    "sub": "sub",
+    "sup": "sup",
+    "code": "code",
+    "a": "a",
+}
+
+INLINE_TAGS = frozenset(MARKS.values())
+
+# Как и в HTML, новый блок закрывает незакрытый абзац, а новый пункт списка ещё и предыдущий пункт
+AUTO_CLOSE: dict[str, frozenset[str]] = {
+    "p": frozenset({"p", "h"}),
+    "h": frozenset({"p", "h"}),
+    "quote": frozenset({"p", "h"}),
+    "ul": frozenset({"p", "h"}),
+    "ol": frozenset({"p", "h"}),
+    "li": frozenset({"p", "h", "li"}),
+}
+
+
+class _HtmlRenderer(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.out: list[Event] = []
+        self.stack: list[str] = []
+        # Текст и inline-теги вне блоков оборачиваются в неявный абзац
+        self.implicit = False
+
+    def _open_implicit(self) -> None:
+        if not self.stack and not self.implicit:
+            self.out.append(("start", "p", {}))
+            self.implicit = True
+
+    def _close_implicit(self) -> None:
+        if self.implicit and not self.stack:
+            self.out.append(("end", "p"))
+            self.implicit = False
+
+    def _auto_close(self, blocks: frozenset[str]) -> None:
+        # Ищем ближайший блок над незакрытыми inline-тегами
+        while True:
+            for opened in reversed(self.stack):
+                if HTML_TAGS[opened] not in INLINE_TAGS:
+                    break
+            else:
+                return
+
+            if HTML_TAGS[opened] not in blocks:
+                return
+            self.handle_endtag(opened)
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        if tag == "img":
+            src = dict(attrs).get("src")
+            if src:
+                self.out.append(("image", src))
+            return
+        if tag == "hr":
+            self._close_implicit()
+            self.out.append(("rule",))
+            return
+        if tag == "br":
+            self._open_implicit()
+            self.out.append(("break",))
+            return
+
+        neutral = HTML_TAGS.get(tag)
+        if neutral is None:
+            return
+
+        if neutral in INLINE_TAGS:
+            self._open_implicit()
+        else:
+            self._close_implicit()
+            self._auto_close(AUTO_CLOSE[neutral])
+
+        if neutral == "h":
+            attributes = {"level": int(tag[1])}
+        elif neutral == "a":
+            attributes = {"href": dict(attrs).get("href") or ""}
+        else:
+            attributes = {}
+
+        self.out.append(("start", neutral, attributes))
+        self.stack.append(tag)
+
+    def handle_startendtag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        self.handle_starttag(tag, attrs)
+        if tag in HTML_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag: str) -> None:
+        # Незакрытые вложенные теги закрываем сами, лишние закрывающие пропускаем
+        if tag not in self.stack:
+            return
+        while self.stack:
+            opened = self.stack.pop()
+            self.out.append(("end", HTML_TAGS[opened]))
+            if opened == tag:
+                break
+
+    def handle_data(self, data: str) -> None:
+        if not self.stack and not self.implicit:
+            if data.isspace():
+                return
+            self._open_implicit()
+        self.out.append(("text", data))
+
+    def close(self) -> None:
+        super().close()
+        if self.stack:
+            self.handle_endtag(self.stack[0])
+        self._close_implicit()
+
+
+def parse_html(content: str) -> list[Event]:
+    parser = _HtmlRenderer()
+    parser.feed(content)
+    parser.close()
+    return parser.out
+
+
+XHTML_TAGS: dict[str, str] = {"quote": "blockquote"}
+
+
+def _escape(text: str) -> str:
+    # В тексте глав спецсимволы редки, а проверка вхождения намного дешевле замены
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+
+def _xhtml_paragraphs(texts: list[str]) -> str:
+    # Абзацы склеиваем одним join, экранировать обычно нечего
+    text = "".join(texts)
+    if "&" in text or "<" in text or ">" in text:
+        return "".join(f"<p>{_escape(text)}</p>" for text in texts)
+    return "<p>" + "</p><p>".join(texts) + "</p>"
+
+
+def to_xhtml(events: Iterable[Event], image_src: Callable[[str], str | None]) -> str:
+    parts: list[str] = []
+    stack: list[str] = []
+    append = parts.append
+
+    for event in events:
+        kind = event[0]
+        if kind == "text":
+            append(_escape(event[1]))
+        elif kind == "start":
+            tag = event[1]
+            if tag == "a":
+                append(f'<a href="{escape(event[2]["href"])}">')
+            else:
+                tag = f"h{event[2]['level']}" if tag == "h" else XHTML_TAGS.get(tag, tag)
+                append(f"<{tag}>")
+            stack.append(tag)
+        elif kind == "end":
+            append(f"</{stack.pop()}>")
+        elif kind == "image":
+            src = image_src(event[1])
+            if src:
+                append(f'<img src="{escape(src)}"/>')
+        elif kind == "rule":
+            append("<hr/>")
+        elif kind == "break":
+            append("<br/>")
+
+    return "".join(parts)
+
+
+def doc_to_xhtml(content: list[dict], image_src: Callable[[str], str | None]) -> str:
+    parts: list[str] = []
+    texts: list[str] = []
+    add_text = texts.append
+    for node in content:
+        type = node.get("type")
+        if type == "paragraph":
+            children = node.get("content") or EMPTY_PARAGRAPH
+            if len(children) == 1:
+                first = children[0]
+                if first.get("type") == "text" and not first.get("marks"):
+                    add_text(first.get("text", ""))
+                    continue
+
+        if texts:
+            parts.append(_xhtml_paragraphs(texts))
+            texts.clear()
+
+        if type == "image":
+            images = (node.get("attrs") or {}).get("images")
+            src = image_src(images[-1].get("image")) if images else None
+            if src:
+                parts.append(f'<img src="{escape(src)}"/>')
+        elif type == "horizontalRule":
+            parts.append("<hr/>")
+        else:
+            events: list[Event] = []
+            NODE_RENDERERS.get(type, _render_children)(node, events)
+            parts.append(to_xhtml(events, image_src))
+
+    if texts:
+        parts.append(_xhtml_paragraphs(texts))
+    return "".join(parts)
+
+
+# В FB2 нет списков и подчёркивания: пункты списка остаются абзацами, подчёркивание становится выделением
+FB2_TAGS: dict[str, str | None] = {
+    "p": "p",
+    "h": "subtitle",
+    "quote": "cite",
+    "ul": None,
+    "ol": None,
+    "li": None,
+    "strong": "strong",
+    "em": "emphasis",
+    "u": "emphasis",
+    "s": "strikethrough",
+    "sub": "sub",
+    "sup": "sup",
+    "code": "code",
+    "a": "a",
+}
+
+# Текст в FB2 может лежать только в абзацах и заголовках, а section и cite содержат только блоки
+FB2_CONTAINERS = frozenset({"section", "cite"})
+
+
+def _append_text(element: ET.Element, text: str) -> None:
+    if len(element):
+        element[-1].tail = (element[-1].tail or "") + text
+    else:
+        element.text = (element.text or "") + text
+
+
+def to_fb2(events: Iterable[Event]) -> list[ET.Element]:
+    root = ET.Element("section")
+    # Списки прозрачны: вместо элемента в стек кладётся тот же контейнер
+    stack: list[ET.Element] = [root]
+    # Текст и выделения прямо в контейнере (пункт списка, цитата без <p>) собираются в неявный абзац,
+    # он открыт до следующего блока или до конца контейнера
+    paragraph: ET.Element | None = None
+
+    def container() -> ET.Element:
+        return next(element for element in reversed(stack) if element.tag in FB2_CONTAINERS)
+
+    def inline_parent() -> ET.Element:
+        nonlocal paragraph
+        if stack[-1].tag not in FB2_CONTAINERS:
+            return stack[-1]
+        if paragraph is None:
+            paragraph = ET.SubElement(stack[-1], "p")
+        return paragraph
+
+    for event in events:
+        kind = event[0]
+        if kind == "text":
+            top = stack[-1]
+            if top.tag not in FB2_CONTAINERS:
+                _append_text(top, event[1])
+            elif paragraph is not None or not event[1].isspace():
+                _append_text(inline_parent(), event[1])
+        elif kind == "start":
+            tag = event[1]
+            fb2_tag = FB2_TAGS.get(tag)
+            if tag in INLINE_TAGS:
+                top = stack[-1]
+                element = ET.SubElement(top if top.tag not in FB2_CONTAINERS else inline_parent(), fb2_tag)
+                if fb2_tag == "a":
+                    element.set("xlink:href", event[2]["href"])
+            else:
+                paragraph = None
+                element = container() if fb2_tag is None else ET.SubElement(container(), fb2_tag)
+            stack.append(element)
+        elif kind == "end":
+            if stack.pop().tag in FB2_CONTAINERS:
+                paragraph = None
+        elif kind == "break":
+            if stack[-1].tag not in FB2_CONTAINERS or paragraph is not None:
+                _append_text(inline_parent(), " ")
+        elif kind == "rule":
+            paragraph = None
+            ET.SubElement(container(), "empty-line")
+
+    return list(root)
+
+
+def doc_to_fb2(content: list[dict]) -> list[ET.Element]:
+    elements: list[ET.Element] = []
+    append, make_element = elements.append, ET.Element
+    for node in content:
+        type = node.get("type")
+        if type == "paragraph":
+            children = node.get("content") or EMPTY_PARAGRAPH
+            if len(children) == 1:
+                first = children[0]
+                if first.get("type") == "text" and not first.get("marks"):
+                    element = make_element("p")
+                    element.text = first.get("text", "")
+                    append(element)
+                    continue
+        elif type == "image":
+            # Как и в to_fb2, картинки в FB2 не переносятся
+            continue
+        elif type == "horizontalRule":
+            append(make_element("empty-line"))
+            continue
+
+        events: list[Event] = []
+        NODE_RENDERERS.get(type, _render_children)(node, events)
+        elements.extend(to_fb2(events))
+
+    return elements
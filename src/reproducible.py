@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+import zipfile
+from datetime import datetime, timezone
+from typing import Iterable
+
+from src.config import config
+from src.model import ChapterMeta
+
+
+HASH_SUFFIX = ".sha256"
+# Увеличиваем, когда меняется то, как книга собирается из тех же глав, чтобы книги пересобрались
+MANIFEST_VERSION = 1
+
+
+def build_time() -> datetime:
+    # Одна и та же дата во всех книгах, чтобы одинаковое содержимое давало одинаковый файл.
+    # Как принято для воспроизводимых сборок, её можно задать через SOURCE_DATE_EPOCH
+    epoch = os.environ.get("SOURCE_DATE_EPOCH")
+    if epoch and epoch.isdigit():
+        return max(datetime.fromtimestamp(int(epoch), timezone.utc), config.book_time)
+    return config.book_time
+
+
+class StableZipFile(zipfile.ZipFile):
+    # Все файлы архива получают одну дату вместо текущего времени записи
+    def writestr(self, zinfo_or_arcname, data, compress_type=None, compresslevel=None) -> None:
+        if not isinstance(zinfo_or_arcname, zipfile.ZipInfo):
+            zinfo_or_arcname = zipfile.ZipInfo(zinfo_or_arcname, build_time().timetuple()[:6])
+            zinfo_or_arcname.compress_type = self.compression
+            zinfo_or_arcname.external_attr = 0o600 << 16
+
+        super().writestr(zinfo_or_arcname, data, compress_type, compresslevel)
+
+
+def book_id(slug: str, branch: str, title: str) -> str:
+    # Идентификатор книги не меняется от сборки к сборке, части одной книги различаются по названию
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{config.site_url}/ru/book/{slug}?branch={branch}#{title}"))
+
+
+def book_metadata(ranobe_data: dict) -> dict:
+    # Только то, что попадает в книгу: просмотры, рейтинг и прочее из ответа API книгу не меняют
+    return {
+        "name": ranobe_data.get("name"),
+        "rus_name": ranobe_data.get("rus_name"),
+        "summary": ranobe_data.get("summary"),
+        "authors": [author.get("name") for author in ranobe_data.get("authors") or []],
+        "genres": [genre.get("name") for genre in ranobe_data.get("genres") or []],
+        "franchise": [franchise.get("name") for franchise in ranobe_data.get("franchise") or []],
+        "cover": (ranobe_data.get("cover") or {}).get("default"),
+    }
+
+
+def manifest_hash(metadata: dict, chapters: Iterable[ChapterMeta]) -> str:
+    # Хэш всего, из чего собирается книга: данные о ранобе и (том, глава, название, хэш текста) каждой главы.
+    # Считается до записи книги, поэтому неизменившаяся книга не собирается в файл заново
+    data = [
+        MANIFEST_VERSION,
+        build_time().isoformat(),
+        metadata,
+        [[item.volume, item.number, item.name, item.hash] for item in chapters],
+    ]
+    return hashlib.sha256(json.dumps(data, ensure_ascii=False, sort_keys=True).encode()).hexdigest()
+
+
+def is_unchanged(path: str, manifest: str) -> bool:
+    # Хэш лежит рядом с книгой (book.epub.sha256). Если он совпал, готовая книга не перезаписывается:
+    # у файла остаётся прежнее время изменения, и синхронизация его не трогает
+    try:
+        with open(path + HASH_SUFFIX, encoding="utf-8") as file:
+            old_manifest = file.read().split(" ", 1)[0]
+    except OSError:
+        return False
+    return old_manifest == manifest and os.path.isfile(path)
+
+
+def replace_if_changed(temp_path: str, path: str, manifest: str, complete: bool = True) -> bool:
+    # complete=False - не скачались картинки или обложка: хэш не сохраняем, чтобы книга собралась заново
+    if is_unchanged(path, manifest):
+        os.remove(temp_path)
+        return False
+
+    shutil.move(temp_path, path)
+    if not complete:
+        if os.path.exists(path + HASH_SUFFIX):
+            os.remove(path + HASH_SUFFIX)
+        return True
+
+    with open(path + HASH_SUFFIX, "w", encoding="utf-8") as file:
+        file.write(f"{manifest}  {os.path.basename(path)}\n")
+    return True
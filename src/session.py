@@ -0,0 +1,53 @@
+import threading
+
+import cloudscraper
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.config import config
+
+
+_lock = threading.Lock()
+_session: requests.Session | None = None
+_scraper: cloudscraper.CloudScraper | None = None
+_token: str = ""
+
+
+def _mount(session: requests.Session) -> None:
+    adapter = HTTPAdapter(pool_connections=config.pool_size, pool_maxsize=config.pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+
+
+def get_session() -> requests.Session:
+    global _session, _token
+
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            _mount(_session)
+
+        # Токен может смениться после вставки в UI, заголовок меняем только тогда
+        if config.token != _token:
+            _token = config.token
+            if _token:
+                _session.headers["Authorization"] = f"Bearer {_token}"
+            else:
+                _session.headers.pop("Authorization", None)
+
+        return _session
+
+
+def get_scraper() -> cloudscraper.CloudScraper:
+    global _scraper
+
+    with _lock:
+        if _scraper is None:
+            _scraper = cloudscraper.create_scraper(
+                delay=15,
+                browser={"browser": "firefox", "platform": "windows", "mobile": False},
+            )
+            _mount(_scraper)
+
+        return _scraper
@@ -0,0 +1,182 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Queue
+from typing import Callable, Literal
+
+from src.chapters import Chapters
+from src.config import config
+from src.fetcher import fill_book
+from src.images import ImagePipeline
+from src.model import ChapterData, ChapterMeta, Handler
+
+
+class SplitHandler(Handler):
+    handler_type: Callable[..., Handler]
+    by: Literal["volume", "chapters", "size"]
+    limit: int
+    dir: str
+    ranobe_data: dict
+    part: Queue | None
+    saving: list[Future]
+    image_pipeline: ImagePipeline
+    own_pipeline: bool
+
+    def __init__(
+        self,
+        log_func: Callable,
+        progress_bar_step: Callable,
+        handler_type: Callable[..., Handler],
+        dir: str,
+        by: Literal["volume", "chapters", "size"] = "volume",
+        limit: int = 0,
+    ) -> None:
+        # limit - число глав для by="chapters" или размер текста глав в байтах для by="size"
+        super().__init__(log_func, progress_bar_step)
+        self.handler_type = handler_type
+        self.dir = dir
+        self.by = by
+        self.limit = limit
+
+        self.part = None
+        self.parts = 0
+        self.saving = []
+        self.writer = ThreadPoolExecutor(max_workers=config.split_workers, thread_name_prefix="part")
+        # Один пул картинок на все части: иначе каждая EPUB-часть поднимала бы свой пул процессов
+        self.image_pipeline = ImagePipeline()
+        self.own_pipeline = True
+
+    def make_book(self, ranobe_data: dict) -> None:
+        # Книги частей создаются по мере скачивания, здесь только запоминаем данные о ранобе
+        self.ranobe_data = ranobe_data
+
+    def fill_book(
+        self,
+        slug: str,
+        priority_branch: str,
+        chapters_data: list[ChapterMeta],
+        worker,
+        delay: float | None = None,
+        source=None,
+    ) -> None:
+        fill_book(self, slug, priority_branch, chapters_data, worker, delay, source)
+
+    def begin_chapters(self, slug: str, priority_branch: str, chapters_data: Chapters) -> None:
+        self.slug = slug
+        self.branch = priority_branch
+        self.chapters_data = chapters_data
+
+    def _is_full(self, item: ChapterMeta) -> bool:
+        match self.by:
+            case "volume":
+                return item.volume != self.part_volume
+            case "chapters":
+                return self.part_chapters >= self.limit
+            case "size":
+                return self.part_size >= self.limit
+
+    def _open_part(self, item: ChapterMeta) -> None:
+        self.parts += 1
+        self.part_volume = item.volume
+        self.part_chapters = 0
+        self.part_size = 0
+
+        start = self.chapters_data.find(item.volume, item.number)
+        match self.by:
+            case "volume":
+                # Конец тома ищем делением пополам, главы с нечисловым номером в конце тома добираем по одной
+                chapters = self.chapters_data
+                end = max(chapters.bisect(item.volume, "inf"), start + 1) if chapters.ordered else start + 1
+                while end < len(chapters) and chapters.volumes[end] == chapters.volumes[start]:
+                    end += 1
+                planned = chapters[start:end]
+                suffix = f"Том {item.volume}"
+            case "chapters":
+                planned = self.chapters_data[start : start + self.limit]
+                suffix = f"Часть {self.parts}"
+            case "size":
+                # Где закончится часть, заранее не известно, поэтому план до конца книги
+                planned = self.chapters_data[start:]
+                suffix = f"Часть {self.parts}"
+
+        # Часть собирает поток записи: главы уходят ему через очередь, скачивание разбор глав не ждёт.
+        # Очередь ограничена, чтобы скачанные главы не копились в памяти, пока пишутся прежние части
+        title = self.ranobe_data.get("rus_name") or self.ranobe_data.get("name")
+        self.part = Queue(maxsize=config.split_queue)
+        self.saving.append(self.writer.submit(self._build_part, f"{title}. {suffix}", planned, self.part))
+
+    def _close_part(self) -> None:
+        if self.part is None:
+            return
+
+        part, self.part = self.part, None
+        part.put(None)
+
+    def _build_part(self, title: str, planned: list[ChapterMeta], chapters: Queue) -> None:
+        entry = ()
+        try:
+            part = self.handler_type(log_func=self.log_func, progress_bar_step=lambda step: None)
+            part.make_book({**self.ranobe_data, "rus_name": title})
+            part.share_images(self.image_pipeline)
+            part.begin_chapters(self.slug, self.branch, planned)
+
+            while (entry := chapters.get()) is not None:
+                item, chapter, source = entry
+                if chapter is None:
+                    part.copy_chapter(item, source)
+                elif not part.add_chapter(chapter, item):
+                    self.log_func("Пропускаем главу.")
+
+            part.end_chapters()
+            part.end_book()
+            part.save_book(self.dir)
+        finally:
+            # Если часть не собралась, дочитываем её главы, иначе скачивание встанет на полной очереди
+            while entry is not None:
+                entry = chapters.get()
+
+    def _part_for(self, item: ChapterMeta) -> None:
+        if self.part is not None and self._is_full(item):
+            self._close_part()
+        if self.part is None:
+            self._open_part(item)
+
+    def add_chapter(self, chapter: ChapterData, item: ChapterMeta) -> bool:
+        self._part_for(item)
+        self.part.put((item, chapter, None))
+
+        self.part_chapters += 1
+        self.part_size += len(str(chapter.content))
+        return True
+
+    def copy_chapter(self, item: ChapterMeta, source) -> None:
+        self._part_for(item)
+        self.part.put((item, None, source))
+        # Размер перенесённой главы не известен без повторного чтения книги, часть считаем только по главам
+        self.part_chapters += 1
+
+    def share_images(self, pipeline: ImagePipeline) -> None:
+        self.image_pipeline.close()
+        self.image_pipeline = pipeline
+        self.own_pipeline = False
+
+    def end_chapters(self) -> None:
+        self._close_part()
+
+    def end_book(self) -> None:
+        pass
+
+    def save_book(self, dir: str) -> None:
+        try:
+            for future in self.saving:
+                try:
+                    future.result()
+                except Exception as e:
+                    self.log_func(str(e))
+        finally:
+            self.writer.shutdown()
+            if self.own_pipeline:
+                self.image_pipeline.close()
+
+        if self.saving:
+            self.log_func(f"Книга разбита на части: {len(self.saving)}, все сохранены в каталоге {self.dir}")
+        else:
+            self.log_func("Нет скачанных глав, сохранять нечего.")
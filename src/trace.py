@@ -0,0 +1,121 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import wraps
+from typing import Callable, Iterator
+
+
+@dataclass
+class Span:
+    name: str
+    args: dict = field(default_factory=dict)
+    thread: str = ""
+    tid: int = 0
+    start: float = 0.0
+    duration: float = 0.0
+    cpu: float = 0.0
+    bytes: int = 0
+
+
+class Tracer:
+    enabled: bool
+    spans: list[Span]
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.spans = []
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def enable(self) -> None:
+        with self.lock:
+            self.enabled = True
+            self.spans = []
+            self.origin = time.perf_counter()
+
+    @contextmanager
+    def span(self, name: str, **args) -> Iterator[Span]:
+        span = Span(name, args)
+        # Выключенная трассировка не замеряет ничего, но код этапа работает так же
+        if not self.enabled:
+            yield span
+            return
+
+        thread = threading.current_thread()
+        span.thread = thread.name
+        span.tid = thread.ident or 0
+        start = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield span
+        finally:
+            span.duration = time.perf_counter() - start
+            span.cpu = time.thread_time() - cpu
+            span.start = start - self.origin
+            with self.lock:
+                self.spans.append(span)
+
+    def export(self, path: str) -> None:
+        # Формат Chrome trace: открывается в chrome://tracing и ui.perfetto.dev
+        with self.lock:
+            spans = list(self.spans)
+
+        pid = os.getpid()
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in {span.tid: span.thread for span in spans}.items()
+        ]
+        for span in spans:
+            events.append(
+                {
+                    "name": span.name,
+                    "ph": "X",
+                    "pid": pid,
+                    "tid": span.tid,
+                    "ts": round(span.start * 1e6),
+                    "dur": round(span.duration * 1e6),
+                    "args": {**span.args, "cpu_ms": round(span.cpu * 1e3, 3), "bytes": span.bytes},
+                }
+            )
+
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file, ensure_ascii=False, default=str)
+
+    def summary(self) -> list[str]:
+        with self.lock:
+            spans = list(self.spans)
+
+        stages: dict[str, list[Span]] = {}
+        for span in spans:
+            stages.setdefault(span.name, []).append(span)
+
+        # Вложенные этапы входят и во время внешних, поэтому столбец "Всего" складывать нельзя
+        header = f"{'Этап':<32} {'Вызовов':>8} {'Всего, с':>9} {'Среднее, мс':>12} {'Макс, мс':>9} {'CPU, с':>8}"
+        lines = [f"{header} {'МиБ':>8}"]
+        for name, items in sorted(stages.items(), key=lambda stage: -sum(span.duration for span in stage[1])):
+            total = sum(span.duration for span in items)
+            lines.append(
+                f"{name:<32} {len(items):>8} {total:>9.2f} {total / len(items) * 1e3:>12.1f} "
+                f"{max(span.duration for span in items) * 1e3:>9.1f} {sum(span.cpu for span in items):>8.2f} "
+                f"{sum(span.bytes for span in items) / 1024 / 1024:>8.2f}"
+            )
+
+        return lines
+
+
+tracer = Tracer()
+
+
+def traced(name: str) -> Callable[[Callable], Callable]:
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,234 @@
+import json
+import os
+import re
+import tempfile
+import zipfile
+from base64 import b64decode
+from typing import BinaryIO, Callable, Iterator
+from xml.etree import ElementTree as ET
+
+from src.api import get_chapters_data, get_ranobe_data
+from src.epub import BOOK_META as EPUB_META, chapter_file_name
+from src.epub_stream import EpubStreamHandler
+from src.fb2 import BOOK_META as FB2_META, HASHES_ID, FB2Handler, section_id
+from src.model import BookMeta, ChapterData, ChapterMeta, Handler
+from src.utils import chapter_hash, chapter_title
+
+
+EPUB_FOLDER = "EPUB"
+EPUB_BODY = re.compile(r"<body[^>]*>(.*)</body>", re.S)
+EPUB_IMAGE = re.compile(r'src="(static/[^"]+)"')
+
+FB2_NS = "{http://www.gribuser.ru/xml/fictionbook/2.0}"
+XLINK_NS = "{http://www.w3.org/1999/xlink}"
+
+
+class BookSource:
+    meta: BookMeta
+    kept: set[tuple[str, str]]
+    hashes: dict[tuple[str, str], str]
+    # Сверять прежние главы с сайтом по хэшу текста: запрос на каждую главу книги
+    verify: bool = False
+
+    def plan(self, chapters_data: list[ChapterMeta]) -> None:
+        # Переносим главы с прежним названием, если они идут в прежнем порядке, остальные скачиваем заново
+        old = {(item.volume, item.number): (i, item.name) for i, item in enumerate(self.meta.chapters)}
+        self.kept = set()
+        self.hashes = {(item.volume, item.number): item.hash for item in self.meta.chapters}
+        last = -1
+        for item in chapters_data:
+            found = old.get((item.volume, item.number))
+            if found is not None and found[1] == item.name and found[0] > last:
+                self.kept.add((item.volume, item.number))
+                last = found[0]
+
+    def has(self, item: ChapterMeta) -> bool:
+        return (item.volume, item.number) in self.kept
+
+    def hash(self, item: ChapterMeta) -> str:
+        return self.hashes.get((item.volume, item.number), "")
+
+    def unchanged(self, item: ChapterMeta, chapter: ChapterData) -> bool:
+        # Главы из книг без хэшей (старые версии программы) считаем изменёнными
+        old = self.hash(item)
+        return self.has(item) and bool(old) and old == chapter_hash(chapter)
+
+    def close(self) -> None:
+        pass
+
+
+class EpubSource(BookSource):
+    zip: zipfile.ZipFile
+
+    def __init__(self, path: str) -> None:
+        self.zip = zipfile.ZipFile(path)
+        try:
+            data = json.loads(self.zip.read(EPUB_META))
+        except Exception:
+            self.zip.close()
+            raise
+
+        self.meta = BookMeta(
+            slug=data["slug"],
+            branch=data["branch"],
+            chapters=[ChapterMeta(**chapter) for chapter in data["chapters"]],
+        )
+        self.kept = set()
+        self.hashes = {}
+
+    def chapter(self, item: ChapterMeta) -> str:
+        content = self.zip.read(f"{EPUB_FOLDER}/{chapter_file_name(item)}").decode("utf-8")
+        return EPUB_BODY.search(content).group(1)
+
+    def images(self, content: str) -> Iterator[tuple[str, bytes]]:
+        for file_name in dict.fromkeys(EPUB_IMAGE.findall(content)):
+            try:
+                yield file_name, self.zip.read(f"{EPUB_FOLDER}/{file_name}")
+            except KeyError:
+                continue
+
+    def close(self) -> None:
+        self.zip.close()
+
+
+class FB2Source(BookSource):
+    path: str
+    file: BinaryIO
+    sections: Iterator[tuple[str, str]]
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        data = None
+        chapters: list[ChapterMeta] = []
+        hashes: dict[tuple[str, str], str] = {}
+
+        for _, element in ET.iterparse(path):
+            if element.tag == f"{FB2_NS}custom-info" and element.get("info-type") == FB2_META:
+                data = json.loads(element.text)
+            elif element.tag == f"{FB2_NS}section" and (element.get("id") or "").startswith("chapter_"):
+                chapters.append(self._chapter_meta(element))
+                element.clear()
+            elif element.tag == f"{FB2_NS}binary":
+                if element.get("id") == HASHES_ID:
+                    hashes = {(volume, number): hash for volume, number, hash in json.loads(b64decode(element.text))}
+                element.clear()
+
+        if data is None:
+            raise KeyError(FB2_META)
+
+        for item in chapters:
+            item.hash = hashes.get((item.volume, item.number), "")
+        self.meta = BookMeta(slug=data["slug"], branch=data["branch"], chapters=chapters)
+        self.kept = set()
+        self.hashes = {}
+
+        self.file = open(path, "rb")
+        self.sections = self._sections()
+
+    @staticmethod
+    def _chapter_meta(section: ET.Element) -> ChapterMeta:
+        _, volume, number = section.get("id").split("_", 2)
+        title = "".join(section.find(f"{FB2_NS}title").itertext())
+        prefix = chapter_title(ChapterMeta(name="", number=number, volume=volume))
+        return ChapterMeta(name=title.removeprefix(prefix), number=number, volume=volume)
+
+    def _sections(self) -> Iterator[tuple[str, str]]:
+        for _, element in ET.iterparse(self.file):
+            if element.tag != f"{FB2_NS}section" or not (element.get("id") or "").startswith("chapter_"):
+                continue
+
+            # Возвращаем секции к виду, в котором их пишет FB2Handler
+            for child in element.iter():
+                child.tag = child.tag.removeprefix(FB2_NS)
+                for key in [key for key in child.attrib if key.startswith(XLINK_NS)]:
+                    child.set("xlink:" + key.removeprefix(XLINK_NS), child.attrib.pop(key))
+            element.tail = None
+
+            yield element.get("id"), ET.tostring(element, encoding="unicode")
+            element.clear()
+
+    def chapter(self, item: ChapterMeta) -> str:
+        # Главы переносятся в порядке книги, поэтому файл читается один раз
+        for id, content in self.sections:
+            if id == section_id(item):
+                return content
+
+        raise Exception(f"В книге нет главы: {chapter_title(item)}")
+
+    def close(self) -> None:
+        self.file.close()
+
+
+UPDATE_FORMATS: dict[str, tuple[type[BookSource], type[Handler]]] = {
+    ".epub": (EpubSource, EpubStreamHandler),
+    ".fb2": (FB2Source, FB2Handler),
+}
+
+
+def update_book(
+    path: str,
+    worker,
+    log_func: Callable,
+    progress_bar_step: Callable,
+    delay: float | None = None,
+    verify: bool = False,
+) -> bool:
+    formats = UPDATE_FORMATS.get(os.path.splitext(path)[1].lower())
+    if formats is None:
+        log_func("Обновлять можно только книги в форматах EPUB и FB2.")
+        return False
+
+    source_type, handler = formats
+    try:
+        source = source_type(path)
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile, ET.ParseError):
+        log_func(f"Книга {path} создана не этой программой или её старой версией, обновить её нельзя.")
+        return False
+
+    try:
+        meta = source.meta
+        log_func(f"\nОбновляем книгу {path}...")
+
+        ranobe_data = get_ranobe_data(meta.slug)
+        chapters_data = ranobe_data and get_chapters_data(meta.slug, ranobe_data.get("chap_count"))
+        if not chapters_data:
+            log_func("Не удалось получить данные о ранобе.")
+            return False
+
+        # Книга начинается с той же главы, что и раньше, а новые главы добавляются в конец
+        if meta.chapters:
+            first = chapters_data.find(meta.chapters[0].volume, meta.chapters[0].number)
+            if first is not None:
+                chapters_data = chapters_data[first:]
+
+        source.plan(chapters_data)
+        source.verify = verify
+        missing = len(chapters_data) - len(source.kept)
+        log_func(f"Глав в книге: {len(meta.chapters)}, без изменений: {len(source.kept)}, нужно скачать: {missing}")
+        if verify:
+            # Правки в тексте видны только по самой главе, поэтому прежние главы тоже запрашиваются:
+            # совпавшие по хэшу переносятся из книги как есть
+            log_func("Прежние главы сверяем с сайтом, неизменённые перенесём из книги.")
+        elif not missing and len(source.kept) == len(meta.chapters):
+            log_func("Новых и изменённых глав нет, книга осталась без изменений.")
+            return True
+
+        ebook = handler(log_func=log_func, progress_bar_step=progress_bar_step)
+        ebook.make_book(ranobe_data)
+        ebook.fill_book(meta.slug, meta.branch, chapters_data, worker, delay, source)
+        ebook.end_book()
+    finally:
+        source.close()
+
+    if worker.is_cancelled:
+        # Недокачанная книга не должна заменить прежнюю
+        with tempfile.TemporaryDirectory() as dir:
+            ebook.save_book_as(os.path.join(dir, os.path.basename(path)))
+        log_func("Обновление прервано, книга осталась прежней.")
+        return False
+
+    if ebook.save_book_as(path):
+        log_func(f"Книга {path} обновлена.")
+    else:
+        log_func(f"Книга {path} без изменений, файл не перезаписан.")
+    return True
@@ -1,5 +1,7 @@
 import re
 import base64
+import hashlib
+import json
 from urllib.parse import urlparse
 
 from jwt import decode, DecodeError
@@ -103,3 +105,27 @@ def is_valid_url(url) -> bool:
         return bool(pattern.match(parsed.path))
 
     return False
+
+
+def chapter_title(item) -> str:
+    return f"Том {item.volume}. Глава {item.number}. {item.name}"
+
+
+def parse_chapter_key(value: str) -> tuple[str, str] | None:
+    # "ТОМ:ГЛАВА", например 2:15
+    volume, _, number = value.strip().partition(":")
+    if not volume or not number:
+        return None
+    return volume.strip(), number.strip()
+
+
+def chapter_hash(chapter) -> str:
+    # По хэшу текста и картинок главы обновление книги замечает правки в уже скачанных главах
+    data = [chapter.type, chapter.content, [attachment.url for attachment in chapter.attachments]]
+    return hashlib.sha256(json.dumps(data, ensure_ascii=False, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def slug_id(slug: str) -> str | None:
+    # slug на сайте начинается с id ранобе: 165329--kusuriya-no-hitorigoto-ln-novel
+    match = re.match(r"^(\d+)--", slug)
+    return match.group(1) if match else None
@@ -0,0 +1,83 @@
+import threading
+
+from rich.cells import cell_len
+from rich.segment import Segment
+from textual.geometry import Size
+from textual.scroll_view import ScrollView
+from textual.strip import Strip
+
+from src.chapters import Chapters
+
+
+class UiUpdates:
+    # Потоки скачивания только складывают сообщения и шаги прогресса,
+    # интерфейс забирает их пачкой несколько раз в секунду (config.ui_fps)
+    lines: list[str]
+    steps: float
+
+    def __init__(self) -> None:
+        self.lines = []
+        self.steps = 0.0
+        self.lock = threading.Lock()
+
+    def log(self, text: str) -> None:
+        with self.lock:
+            self.lines.append(text)
+
+    def advance(self, step: float = 1) -> None:
+        with self.lock:
+            self.steps += step
+
+    def drain(self) -> tuple[list[str], float]:
+        with self.lock:
+            lines, self.lines = self.lines, []
+            steps, self.steps = self.steps, 0.0
+
+        return lines, steps
+
+
+class ChapterList(ScrollView):
+    # Строки списка глав собираются только для видимой части, а не для всех глав сразу
+    DEFAULT_CSS = """
+    ChapterList {
+        background: $surface;
+        color: $text;
+        overflow: scroll;
+    }
+    """
+
+    chapters: Chapters
+
+    def __init__(self, *, id: str | None = None, classes: str | None = None) -> None:
+        super().__init__(id=id, classes=classes)
+        self.chapters = Chapters([], [], [])
+        self.widths = (0, 0, 0)
+
+    def set_chapters(self, chapters: Chapters) -> None:
+        self.chapters = chapters
+        self.widths = chapters.widths()
+        width = len(self._line(len(chapters) - 1)) + max(map(len, chapters.names)) if chapters else 0
+
+        self.virtual_size = Size(width, len(chapters))
+        self.scroll_to(0, 0, animate=False)
+        self.refresh()
+
+    def clear(self) -> None:
+        self.set_chapters(Chapters([], [], []))
+
+    def _line(self, index: int, name: bool = False) -> str:
+        total_len, chap_len, volume_len = self.widths
+        volume, number = self.chapters.volumes[index], self.chapters.numbers[index]
+        line = f"{index + 1:>{total_len}}: Том {volume:>{volume_len}}. Глава {number:>{chap_len}}. "
+        return line + self.chapters.names[index] if name else line
+
+    def render_line(self, y: int) -> Strip:
+        scroll_x, scroll_y = self.scroll_offset
+        index = scroll_y + y
+        width = self.size.width
+        rich_style = self.rich_style
+        if index >= len(self.chapters):
+            return Strip.blank(width, rich_style)
+
+        line = self._line(index, name=True)
+        return Strip([Segment(line, rich_style)], cell_len(line)).crop_extend(scroll_x, scroll_x + width, rich_style)
@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from src.chapters import Chapters, _stream_array
+
+
+def chunked(data: bytes, size: int) -> list[bytes]:
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+ITEMS = [
+    {"name": "Пролог", "number": "0", "volume": "1", "branches": [{"branch_id": None}]},
+    {"name": "Глава", "number": "1.5", "volume": "1", "branches": [{"branch_id": 7}]},
+    {"name": "Финал", "number": 10, "volume": 2, "branches": []},
+]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1024])
+def test_stream_array_survives_any_chunking(size):
+    data = json.dumps({"meta": {"data": [1, 2]}, "data": ITEMS, "links": [3.25]}, ensure_ascii=False).encode()
+    assert list(_stream_array(chunked(data, size), "data")) == ITEMS
+
+
+def test_stream_array_number_split_at_chunk_border():
+    assert list(_stream_array([b'{"data": [12', b"34, 5]}"], "data")) == [1234, 5]
+
+
+def test_stream_array_without_key_yields_nothing():
+    assert list(_stream_array([b'{"other": [1, 2], "data": null}'], "data")) == []
+
+
+def test_stream_array_truncated_response():
+    with pytest.raises(ValueError):
+        list(_stream_array([b'{"data": [{"name": "a"}, '], "data"))
+
+
+def test_from_stream_keeps_columns():
+    chapters = Chapters.from_stream(chunked(json.dumps({"data": ITEMS}).encode(), 5))
+    assert chapters.numbers == ["0", "1.5", "10"]
+    assert chapters.volumes == ["1", "1", "2"]
+    assert chapters.branches == [("0",), ("7",), ()]
+
+
+def make_chapters(keys: list[tuple[str, str]]) -> Chapters:
+    return Chapters([f"{volume}:{number}" for volume, number in keys], [k[1] for k in keys], [k[0] for k in keys])
+
+
+def test_find_ordered():
+    chapters = make_chapters([("1", "1"), ("1", "2"), ("1", "2.5"), ("2", "1"), ("2", "10")])
+    assert chapters.ordered
+    assert chapters.find("1", "2.5") == 2
+    assert chapters.find(2, 10) == 4
+
+
+def test_find_missing_pair():
+    chapters = make_chapters([("1", "1"), ("1", "3"), ("2", "1")])
+    assert chapters.find("1", "2") is None
+    assert chapters.find("3", "1") is None
+    assert chapters.find("0", "1") is None
+
+
+def test_find_distinguishes_equal_numeric_keys():
+    chapters = make_chapters([("1", "1"), ("1", "1.0"), ("1", "2")])
+    assert chapters.find("1", "1.0") == 1
+    assert chapters.find("1", "01") is None
+
+
+def test_find_unordered():
+    chapters = make_chapters([("2", "1"), ("1", "5"), ("1", "extra")])
+    assert not chapters.ordered
+    assert chapters.find("1", "5") == 1
+    assert chapters.find("1", "extra") == 2
+    assert chapters.find("1", "6") is None
+
+
+def test_between_uses_nearest_chapters_for_missing_bounds():
+    chapters = make_chapters([("1", "1"), ("1", "3"), ("2", "1"), ("2", "4")])
+    assert [item.number for item in chapters.between(("1", "2"), ("2", "3"))] == ["3", "1"]
+    assert [item.number for item in chapters.between(("1", "3"), ("2", "4"))] == ["3", "1", "4"]
+    assert len(chapters.between(("3", "1"))) == 0
@@ -0,0 +1,37 @@
+from concurrent.futures import Future
+
+import pytest
+
+from src import fb2
+from src.fb2 import COVER_ID, FB2Handler
+from src.model import ChapterData, ChapterMeta
+
+
+RANOBE = {"name": "Книга", "authors": [], "genres": [], "summary": "", "cover": {"default": "https://img.test/c.jpg"}}
+
+
+def build(tmp_path, monkeypatch, cover: Future) -> str:
+    monkeypatch.setattr(fb2, "fetch_cover", lambda url: cover)
+    item = ChapterMeta(name="Глава", number="1", volume="1")
+    handler = FB2Handler(log_func=lambda *args: None, progress_bar_step=lambda step: None)
+    handler.make_book(RANOBE)
+    handler.begin_chapters("slug", "0", [item])
+    handler.add_chapter(ChapterData(id="1", number=1, volume=1, type="html", content="<p>текст</p>"), item)
+    handler.end_chapters()
+    handler.end_book()
+    handler.save_book_as(str(tmp_path / "book.fb2"))
+    return (tmp_path / "book.fb2").read_text(encoding="utf-8")
+
+
+@pytest.mark.parametrize("loaded", [True, False])
+def test_cover_link_points_to_binary(tmp_path, monkeypatch, loaded):
+    cover = Future()
+    if loaded:
+        cover.set_result(b"jpeg")
+    else:
+        cover.set_exception(Exception("нет обложки"))
+
+    book = build(tmp_path, monkeypatch, cover)
+
+    assert (f'xlink:href="#{COVER_ID}"' in book) == loaded
+    assert (f'<binary id="{COVER_ID}"' in book) == loaded
@@ -0,0 +1,74 @@
+import os
+import tempfile
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from src.epub import EpubHandler
+from src.images import ImageStore
+from src.model import ChapterData, ChapterMeta
+
+
+def test_image_store_round_trip():
+    store = ImageStore()
+    try:
+        first = store.put(b"first image")
+        empty = store.put(b"")
+        second = store.put(bytes(range(256)) * 4)
+
+        assert store.read(*second) == bytes(range(256)) * 4
+        assert store.read(*first) == b"first image"
+        assert store.read(*empty) == b""
+        assert store.size == len(b"first image") + 1024
+    finally:
+        store.close()
+
+
+def test_image_store_parallel_puts():
+    store = ImageStore()
+    try:
+        contents = [os.urandom(n) for n in range(1, 200)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            positions = list(executor.map(store.put, contents))
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            assert list(executor.map(lambda position: store.read(*position), positions)) == contents
+    finally:
+        store.close()
+
+
+IMAGES = {"https://img.test/a.png": b"png image", "https://img.test/b.jpg": b"jpeg image"}
+
+
+class Pipeline:
+    def submit(self, url: str, format: str) -> Future:
+        future = Future()
+        future.set_result(IMAGES[url])
+        return future
+
+
+def test_epub_images_go_through_store_and_are_cleaned_up(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path / "tmp"))
+    os.mkdir(tmp_path / "tmp")
+    os.mkdir(tmp_path / "out")
+
+    handler = EpubHandler(log_func=lambda *args: None, progress_bar_step=lambda step: None)
+    handler.make_book({"name": "Книга", "authors": [], "genres": [], "summary": ""})
+    handler.share_images(Pipeline())
+    item = ChapterMeta(name="Глава", number="1", volume="1")
+    handler.begin_chapters("slug", "0", [item])
+    content = '<p>text</p><img src="https://img.test/a.png"><img src="https://img.test/b.jpg">'
+    assert handler.add_chapter(ChapterData(id="7", number=1, volume=1, type="html", content=content), item)
+    handler.end_chapters()
+    handler.end_book()
+
+    store = handler.image_store
+    assert store is not None and store.size == sum(map(len, IMAGES.values()))
+
+    assert handler.save_book_as(str(tmp_path / "out" / "book.epub"))
+    assert handler.image_store is None
+    assert store.file.closed
+    assert os.listdir(tmp_path / "tmp") == []
+    assert sorted(os.listdir(tmp_path / "out")) == ["book.epub", "book.epub.sha256"]
+
+    with zipfile.ZipFile(tmp_path / "out" / "book.epub") as book:
+        assert book.read("EPUB/static/7_a.png") == b"png image"
+        assert book.read("EPUB/static/7_b.jpg") == b"jpeg image"
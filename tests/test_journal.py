@@ -0,0 +1,40 @@
+from src.config import config
+from src.journal import Journal
+from src.model import Attachment, ChapterData, ChapterMeta
+
+
+def chapter(number: str) -> tuple[ChapterMeta, ChapterData]:
+    attachment = Attachment(id="1", filename="a.png", name="a", extension="png", url="/a.png", width=1, height=1)
+    data = ChapterData(id=number, number=int(number), volume=1, type="html", content=f"<p>{number}</p>")
+    data.attachments.append(attachment)
+    return ChapterMeta(name=f"Глава {number}", number=number, volume="1"), data
+
+
+def test_journal_replays_chapters_from_disk(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "cache_dir", str(tmp_path))
+    items = [chapter(str(i)) for i in range(1, 4)]
+
+    journal = Journal("slug", "0")
+    journal.begin([item for item, _ in items])
+    for item, data in items[:2]:
+        journal.record(item, data)
+    journal.close(complete=False)
+    with open(journal.path, "a", encoding="utf-8") as file:
+        file.write('{"type": "chapter", "volume": "1", "number": "3", "da')
+
+    resumed = Journal("slug", "0")
+    assert resumed.done == 2
+    assert all(isinstance(position, tuple) for position in resumed.chapters.values())
+    assert resumed.get(items[0][0]) == items[0][1]
+    assert resumed.get(items[1][0]) == items[1][1]
+    assert resumed.get(items[2][0]) is None
+
+    found = Journal.find("slug")
+    assert (found.start, found.end, found.total, found.done, found.chapters) == (("1", "1"), ("1", "3"), 3, 2, {})
+
+    resumed.record(*items[2])
+    resumed.close(complete=False)
+    assert Journal("slug", "0").get(items[2][0]) == items[2][1]
+
+    resumed.close(complete=True)
+    assert Journal.find("slug") is None
@@ -0,0 +1,91 @@
+import pytest
+
+from src import ratelimit
+from src.config import config
+from src.ratelimit import AdaptiveRateLimiter
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(ratelimit.time, "sleep", clock.sleep)
+    return clock
+
+
+def test_acquire_spends_burst_then_waits_for_rate(clock):
+    limiter = AdaptiveRateLimiter(2.0, 1.0, 10.0, capacity=2)
+
+    limiter.acquire()
+    limiter.acquire()
+    assert clock.sleeps == []
+
+    limiter.acquire()
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+
+def test_throttle_backs_off_once_per_burst(clock):
+    log = []
+    limiter = AdaptiveRateLimiter(8.0, 1.0, 10.0, log_func=log.append)
+
+    limiter.throttle()
+    limiter.throttle()
+    assert limiter.rate == 8.0 * config.rate_backoff
+
+    clock.now += 1.0
+    limiter.throttle()
+    assert limiter.rate == 8.0 * config.rate_backoff**2
+    assert len(log) == 2
+
+
+def test_throttle_does_not_go_below_min_rate(clock):
+    limiter = AdaptiveRateLimiter(2.0, 1.5, 10.0)
+
+    for _ in range(3):
+        limiter.throttle()
+        clock.now += 1.0
+
+    assert limiter.rate == 1.5
+
+
+def test_throttle_pause_delays_next_request(clock):
+    limiter = AdaptiveRateLimiter(4.0, 1.0, 10.0, capacity=4)
+
+    limiter.throttle(pause=3.0)
+    limiter.acquire()
+
+    assert clock.sleeps[0] == pytest.approx(3.0)
+    assert clock.now >= 1003.0
+
+
+def test_success_recovers_additively_after_backoff(clock):
+    log = []
+    limiter = AdaptiveRateLimiter(4.0, 1.0, 10.0, log_func=log.append)
+
+    limiter.success()
+    assert limiter.rate == 4.0 + config.rate_increase
+
+    limiter.throttle()
+    backed_off = limiter.rate
+    assert backed_off == 5.0 * config.rate_backoff
+
+    limiter.success()
+    assert limiter.rate == pytest.approx(backed_off + config.rate_increase / backed_off)
+
+    for _ in range(200):
+        limiter.success()
+    assert limiter.rate == 10.0
+    assert "ускоряемся" in log[-1]
@@ -0,0 +1,90 @@
+from xml.etree import ElementTree as ET
+
+from src.render import parse_html, to_fb2
+
+
+def test_parse_html_events():
+    assert parse_html('<h3>Title</h3><p>a &amp; <a href="/u">link</a></p><hr><img src="/a.jpg">') == [
+        ("start", "h", {"level": 3}),
+        ("text", "Title"),
+        ("end", "h"),
+        ("start", "p", {}),
+        ("text", "a & "),
+        ("start", "a", {"href": "/u"}),
+        ("text", "link"),
+        ("end", "a"),
+        ("end", "p"),
+        ("rule",),
+        ("image", "/a.jpg"),
+    ]
+
+
+def test_parse_html_closes_unclosed_tags():
+    assert parse_html("<p>a <b>bold") == [
+        ("start", "p", {}),
+        ("text", "a "),
+        ("start", "strong", {}),
+        ("text", "bold"),
+        ("end", "strong"),
+        ("end", "p"),
+    ]
+
+
+def test_parse_html_auto_closes_paragraph_with_open_marks():
+    assert parse_html("<p><b>one<p>two") == [
+        ("start", "p", {}),
+        ("start", "strong", {}),
+        ("text", "one"),
+        ("end", "strong"),
+        ("end", "p"),
+        ("start", "p", {}),
+        ("text", "two"),
+        ("end", "p"),
+    ]
+
+
+def test_parse_html_auto_closes_list_items():
+    assert parse_html("<ul><li>one<li>two</ul>") == [
+        ("start", "ul", {}),
+        ("start", "li", {}),
+        ("text", "one"),
+        ("end", "li"),
+        ("start", "li", {}),
+        ("text", "two"),
+        ("end", "li"),
+        ("end", "ul"),
+    ]
+
+
+def test_parse_html_wraps_loose_text_and_skips_stray_tags():
+    assert parse_html("<div><span>text</span></b> <i>x</i></div>") == [
+        ("start", "p", {}),
+        ("text", "text"),
+        ("text", " "),
+        ("start", "em", {}),
+        ("text", "x"),
+        ("end", "em"),
+        ("end", "p"),
+    ]
+
+
+def fb2(html: str) -> str:
+    return "".join(ET.tostring(element, encoding="unicode") for element in to_fb2(parse_html(html)))
+
+
+def test_fb2_list_item_is_one_paragraph():
+    assert fb2("<ul><li>text <b>bold</b></li></ul>") == "<p>text <strong>bold</strong></p>"
+
+
+def test_fb2_list_items_are_separate_paragraphs():
+    assert fb2("<ol><li>one</li>\n<li><p>two</p></li></ol>") == "<p>one</p><p>two</p>"
+
+
+def test_fb2_quote_text_is_wrapped_in_paragraph():
+    assert fb2("<blockquote>bare quote</blockquote>") == "<cite><p>bare quote</p></cite>"
+
+
+def test_fb2_quote_keeps_paragraphs():
+    assert fb2("<blockquote><p>one</p> two <i>three</i></blockquote>") == (
+        "<cite><p>one</p><p> two <emphasis>three</emphasis></p></cite>"
+    )
@@ -0,0 +1,117 @@
+import os
+import time
+import zipfile
+from concurrent.futures import Future
+
+from src.epub import EpubHandler
+from src.fb2 import FB2Handler
+from src.model import ChapterData, ChapterMeta
+from src.reproducible import HASH_SUFFIX, StableZipFile, book_id
+
+
+RANOBE = {"name": "Книга", "rus_name": "Книга", "authors": [{"name": "Автор"}], "genres": [], "summary": "О книге"}
+
+
+def write_zip(path: str, zip_type: type[zipfile.ZipFile]) -> bytes:
+    with zip_type(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        archive.writestr("EPUB/text.xhtml", "<p>text</p>" * 100)
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def test_stable_zip_ignores_write_time(tmp_path, monkeypatch):
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now)
+    first, plain = write_zip(tmp_path / "a.zip", StableZipFile), write_zip(tmp_path / "a.zip", zipfile.ZipFile)
+
+    monkeypatch.setattr(time, "time", lambda: now + 3 * 24 * 3600)
+    assert write_zip(tmp_path / "b.zip", StableZipFile) == first
+    assert write_zip(tmp_path / "b.zip", zipfile.ZipFile) != plain
+
+
+def test_book_id_is_stable():
+    assert book_id("slug", "0", "Книга") == book_id("slug", "0", "Книга")
+    assert book_id("slug", "0", "Книга. Том 1") != book_id("slug", "0", "Книга. Том 2")
+    assert book_id("slug", "0", "Книга") != book_id("slug", "1", "Книга")
+
+
+def build(handler_type, path: str, texts: list[str]) -> bool:
+    items = [ChapterMeta(name=f"Глава {i}", number=str(i), volume="1") for i in range(1, len(texts) + 1)]
+    handler = handler_type(log_func=lambda *args: None, progress_bar_step=lambda step: None)
+    handler.make_book(RANOBE)
+    handler.begin_chapters("slug", "0", items)
+    for item, text in zip(items, texts, strict=True):
+        handler.add_chapter(ChapterData(id=item.number, number=1, volume=1, type="html", content=text), item)
+    handler.end_chapters()
+    handler.end_book()
+    return handler.save_book_as(path)
+
+
+def test_epub_is_byte_identical_across_runs(tmp_path, monkeypatch):
+    texts = ["<p>один</p>", "<p>два</p><p>три</p>"]
+    assert build(EpubHandler, str(tmp_path / "a.epub"), texts)
+
+    later = time.time() + 3 * 24 * 3600
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert build(EpubHandler, str(tmp_path / "b.epub"), texts)
+
+    assert (tmp_path / "a.epub").read_bytes() == (tmp_path / "b.epub").read_bytes()
+
+
+def test_unchanged_book_is_not_rewritten(tmp_path):
+    for handler_type, name in ((EpubHandler, "book.epub"), (FB2Handler, "book.fb2")):
+        path = str(tmp_path / name)
+        assert build(handler_type, path, ["<p>один</p>", "<p>два</p>"])
+        os.utime(path, (0, 0))
+
+        assert not build(handler_type, path, ["<p>один</p>", "<p>два</p>"])
+        assert os.path.getmtime(path) == 0
+
+        assert build(handler_type, path, ["<p>один</p>", "<p>правка</p>"])
+        assert os.path.getmtime(path) != 0
+
+    assert sorted(os.listdir(tmp_path)) == ["book.epub", "book.epub.sha256", "book.fb2", "book.fb2.sha256"]
+
+
+class Pipeline:
+    def __init__(self, error: Exception | None = None) -> None:
+        self.error = error
+
+    def submit(self, url: str, format: str) -> Future:
+        future = Future()
+        if self.error is not None:
+            future.set_exception(self.error)
+        else:
+            future.set_result(b"image")
+        return future
+
+
+def build_with_image(path: str, pipeline: Pipeline) -> bool:
+    item = ChapterMeta(name="Глава", number="1", volume="1")
+    handler = EpubHandler(log_func=lambda *args: None, progress_bar_step=lambda step: None)
+    handler.make_book(RANOBE)
+    handler.share_images(pipeline)
+    handler.begin_chapters("slug", "0", [item])
+    content = '<p>text</p><img src="https://img.test/a.png">'
+    handler.add_chapter(ChapterData(id="1", number=1, volume=1, type="html", content=content), item)
+    handler.end_chapters()
+    handler.end_book()
+    return handler.save_book_as(path)
+
+
+def test_book_with_failed_image_is_rebuilt(tmp_path):
+    path = str(tmp_path / "book.epub")
+
+    assert build_with_image(path, Pipeline(Exception("нет картинки")))
+    assert not os.path.exists(path + HASH_SUFFIX)
+
+    assert build_with_image(path, Pipeline())
+    assert os.path.exists(path + HASH_SUFFIX)
+    with zipfile.ZipFile(path) as book:
+        assert book.read("EPUB/static/1_a.png") == b"image"
+
+    # Прежняя полная книга не заменяется той же книгой без картинки
+    assert not build_with_image(path, Pipeline(Exception("нет картинки")))
+    with zipfile.ZipFile(path) as book:
+        assert book.read("EPUB/static/1_a.png") == b"image"
@@ -0,0 +1,57 @@
+from src.chapters import Chapters
+from src.model import ChapterData, Handler
+from src.split import SplitHandler
+
+
+class Part(Handler):
+    parts: list = []
+
+    def fill_book(self, *args, **kwargs) -> None:
+        pass
+
+    def make_book(self, ranobe_data: dict) -> None:
+        self.title = ranobe_data["rus_name"]
+        self.added = []
+
+    def begin_chapters(self, slug, priority_branch, chapters_data) -> None:
+        self.planned = [(item.volume, item.number) for item in chapters_data]
+
+    def add_chapter(self, chapter, item) -> bool:
+        self.added.append((item.volume, item.number))
+        return True
+
+    def copy_chapter(self, item, source) -> None:
+        pass
+
+    def share_images(self, pipeline) -> None:
+        pass
+
+    def end_book(self) -> None:
+        pass
+
+    def save_book(self, dir: str) -> None:
+        Part.parts.append(self)
+
+
+def test_split_by_volume_plans_each_volume():
+    numbers = ["1", "2", "x", "3", "4", "y", "5"]
+    volumes = ["1", "1", "1", "2", "2", "2", "3"]
+    chapters = Chapters([""] * len(numbers), numbers, volumes)
+    Part.parts = []
+
+    split = SplitHandler(lambda *args: None, lambda step: None, handler_type=Part, dir="", by="volume")
+    split.make_book({"name": "Книга"})
+    split.begin_chapters("slug", "0", chapters)
+    for item in chapters:
+        split.add_chapter(ChapterData(id="", number=0, volume=0, type="html", content=""), item)
+    split.end_chapters()
+    split.save_book("")
+
+    parts = sorted(Part.parts, key=lambda part: part.title)
+    assert [part.title for part in parts] == ["Книга. Том 1", "Книга. Том 2", "Книга. Том 3"]
+    assert [part.planned for part in parts] == [
+        [("1", "1"), ("1", "2"), ("1", "x")],
+        [("2", "3"), ("2", "4"), ("2", "y")],
+        [("3", "5")],
+    ]
+    assert [part.added for part in parts] == [part.planned for part in parts]